@@ -1,59 +1,300 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 class ExchangeRateAPI:
-    def __init__(self):
+    # Pairs prefetched by warmup(); inverses are cached alongside them
+    WARM_PAIRS = [("USD", "EUR"), ("USD", "GBP"), ("USD", "JPY"), ("USD", "ETB")]
+    # Cached rates from this base answer cross pairs (X -> Y) without a request
+    CROSS_BASE = "USD"
+
+    def __init__(self, store=None):
         self.base_url = "https://api.fastforex.io"
         self.api_key = os.getenv("FASTFOREX_API_KEY")
         if not self.api_key:
             raise ValueError("FASTFOREX_API_KEY environment variable is not set")
 
+        # Reuse one pooled keep-alive session for all FastForex calls
+        self.timeout = (3, 10)  # (connect, read) seconds
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"Accept": "application/json", "User-Agent": "finagent/1.0"}
+        )
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Rates change slowly; serve repeat lookups from memory
+        self._cache_lock = threading.RLock()
+        self._rate_cache = TTLCache(maxsize=512, ttl=300)
+        self._currency_cache = TTLCache(maxsize=2, ttl=86400)
+
+        # Optional persistent store (Database) of last-good rates, served
+        # marked stale when FastForex can't be reached
+        self.store = store
+
+        # Concurrent misses share upstream calls: one in-flight future per
+        # pair, and pairs with the same base are merged into one fetch-multi
+        self._batch_window = 0.05  # seconds
+        # Backstop for waiters; covers the HTTP timeout across every retry
+        self._result_timeout = 60  # seconds
+        self._inflight = {}
+        self._pending = {}
+        # Sized to the HTTP pool so parallel lookups never wait on a socket
+        self._executor = ThreadPoolExecutor(max_workers=20)
+
     def get_exchange_rate(self, from_currency, to_currency, date=None):
         """
         Fetch exchange rate between two currencies using FastForex API
         """
-        url = f"{self.base_url}/fetch-one"
-        params = {"from": from_currency, "to": to_currency, "api_key": self.api_key}
+        key = f"{from_currency}:{to_currency}"
+        with self._cache_lock:
+            cached = self._rate_cache.get(key)
+            if cached is None:
+                cached = self._cross_rate(from_currency, to_currency)
+            if cached is not None:
+                return cached
+
+            future = self._inflight.get(key)
+            leader = False
+            if future is None:
+                future = self._inflight[key] = Future()
+                batch = self._pending.get(from_currency)
+                if batch is None:
+                    batch = self._pending[from_currency] = {}
+                    leader = True
+                # Join a future already queued for this pair rather than
+                # replacing it, which would leave its waiters unresolved
+                future = self._inflight[key] = batch.setdefault(to_currency, future)
+
+        if leader:
+            # Give other lookups for the same base a moment to join the batch
+            time.sleep(self._batch_window)
+            with self._cache_lock:
+                batch = self._pending.pop(from_currency)
+            self._fetch_batch(from_currency, batch)
+
+        try:
+            return future.result(timeout=self._result_timeout)
+        except FutureTimeoutError:
+            return {"success": False, "error": "Exchange rate lookup timed out"}
+
+    def get_exchange_rates(self, pairs):
+        """
+        Fetch several (from_currency, to_currency) pairs concurrently, keyed by pair
+        """
+        results = self._executor.map(lambda pair: self.get_exchange_rate(*pair), pairs)
+        return dict(zip(pairs, results))
+
+    def warmup(self, pairs=None):
+        """
+        Prefetch rates into the cache with one request per base currency
+        """
+        batches = {}
+        for from_currency, to_currency in pairs or self.WARM_PAIRS:
+            batches.setdefault(from_currency, {})[to_currency] = Future()
+        for from_currency, batch in batches.items():
+            self._fetch_batch(from_currency, batch)
+        self.get_available_currencies()
+
+    def start_refresher(self, pairs=None, interval=240):
+        """
+        Keep warm pairs cached by re-fetching them just before the rate TTL expires
+        """
+
+        def refresh_loop():
+            while True:
+                try:
+                    self.warmup(pairs)
+                except Exception as e:
+                    logger.error(f"Error refreshing exchange rates: {str(e)}")
+                time.sleep(interval)
 
+        threading.Thread(target=refresh_loop, daemon=True).start()
+
+    def _fetch_batch(self, from_currency, batch):
+        """
+        Fetch all queued target currencies for one base and resolve their futures
+        """
+        targets = list(batch)
+        results = {}
+        fetched = False
         try:
-            response = requests.get(url, params=params)
+            if len(targets) == 1:
+                url = f"{self.base_url}/fetch-one"
+            else:
+                url = f"{self.base_url}/fetch-multi"
+            params = {
+                "from": from_currency,
+                "to": ",".join(targets),
+                "api_key": self.api_key,
+            }
+            response = self.session.get(url, params=params, timeout=self.timeout)
             response.raise_for_status()
             data = response.json()
+            # fetch-one answers under "result", fetch-multi under "results"
+            rates = data.get("results") or data.get("result") or {}
+            results = {
+                to_currency: self._build_rate_result(
+                    from_currency, to_currency, rates.get(to_currency), data["updated"]
+                )
+                for to_currency in targets
+            }
+            fetched = True
+        except Exception as e:
+            results = {
+                to_currency: self._stale_rate(from_currency, to_currency)
+                or {"success": False, "error": str(e)}
+                for to_currency in targets
+            }
+        finally:
+            # Every waiter must be released, even if building the results failed
+            for to_currency in targets:
+                results.setdefault(
+                    to_currency,
+                    {"success": False, "error": "Exchange rate lookup failed"},
+                )
+            with self._cache_lock:
+                for to_currency, result in results.items():
+                    # Stale fallbacks stay uncached so the next lookup retries
+                    if result["success"] and not result.get("stale"):
+                        self._cache_rate(result)
+                    # warmup() fetches with futures of its own; only clear
+                    # the in-flight entry if it is the one being resolved
+                    key = f"{from_currency}:{to_currency}"
+                    if self._inflight.get(key) is batch[to_currency]:
+                        del self._inflight[key]
+            for to_currency, result in results.items():
+                batch[to_currency].set_result(result)
 
-            # Extract the rate from the new response format
-            rate = data["result"].get(to_currency)
-            if rate is None:
-                return {
-                    "success": False,
-                    "error": f"Exchange rate not found for {to_currency}",
-                }
+        if fetched:
+            try:
+                self._store_rates(results.values())
+            except Exception as e:
+                logger.error(f"Error storing exchange rates: {str(e)}")
 
+    def _build_rate_result(self, from_currency, to_currency, rate, date):
+        """Build the result dict returned for a single currency pair"""
+        if rate is None:
             return {
+                "success": False,
+                "error": f"Exchange rate not found for {to_currency}",
+            }
+
+        return {
+            "success": True,
+            "rate": rate,
+            "date": date,
+            "from": from_currency,
+            "to": to_currency,
+        }
+
+    def _cache_rate(self, result):
+        """Store a successful rate lookup and its inverse pair (caller holds the lock)"""
+        self._rate_cache[f"{result['from']}:{result['to']}"] = result
+        # The inverse pair comes for free
+        if result["rate"]:
+            self._rate_cache[f"{result['to']}:{result['from']}"] = {
                 "success": True,
-                "rate": rate,
-                "date": data["updated"],
-                "from": from_currency,
-                "to": to_currency,
+                "rate": 1 / result["rate"],
+                "date": result["date"],
+                "from": result["to"],
+                "to": result["from"],
             }
-        except requests.RequestException as e:
-            return {"success": False, "error": str(e)}
+
+    def _store_rates(self, results):
+        """Persist successful lookups as the last-good rate for their day"""
+        if self.store is None:
+            return
+        for result in results:
+            if result["success"]:
+                self.store.add_exchange_rate(
+                    result["from"],
+                    result["to"],
+                    result["rate"],
+                    str(result["date"])[:10],
+                )
+
+    def _stale_rate(self, from_currency, to_currency):
+        """Return the last persisted rate for a pair marked stale, or None"""
+        if self.store is None:
+            return None
+        try:
+            stored = self.store.get_exchange_rate(from_currency, to_currency)
+        except Exception:
+            return None
+        if stored is None:
+            return None
+
+        logger.warning(
+            f"Serving stale exchange rate for {from_currency}:{to_currency}"
+        )
+        return {
+            "success": True,
+            "rate": stored["rate"],
+            "date": stored["date"],
+            "from": from_currency,
+            "to": to_currency,
+            "stale": True,
+        }
+
+    def _cross_rate(self, from_currency, to_currency):
+        """Derive a pair from two cached CROSS_BASE rates, or None (caller holds the lock)"""
+        base_from = self._rate_cache.get(f"{self.CROSS_BASE}:{from_currency}")
+        base_to = self._rate_cache.get(f"{self.CROSS_BASE}:{to_currency}")
+        if base_from is None or base_to is None or not base_from["rate"]:
+            return None
+
+        # Not cached itself, so it can never outlive the rates it came from
+        return {
+            "success": True,
+            "rate": base_to["rate"] / base_from["rate"],
+            "date": min(base_from["date"], base_to["date"]),
+            "from": from_currency,
+            "to": to_currency,
+        }
 
     def get_available_currencies(self):
         """
         Fetch list of available currencies from FastForex API
         """
+        with self._cache_lock:
+            cached = self._currency_cache.get("currencies")
+        if cached is not None:
+            return cached
+
         url = f"{self.base_url}/currencies"
         params = {"api_key": self.api_key}
 
         try:
-            response = requests.get(url, params=params)
+            response = self.session.get(url, params=params, timeout=self.timeout)
             response.raise_for_status()
             data = response.json()
-            return {"success": True, "symbols": data.get("currencies", {})}
+            result = {"success": True, "symbols": data.get("currencies", {})}
+            with self._cache_lock:
+                self._currency_cache["currencies"] = result
+            return result
         except requests.RequestException as e:
             return {"success": False, "error": str(e)}
@@ -1,16 +1,39 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from functools import wraps
+from flask import (
+    Flask,
+    Response,
+    render_template,
+    request,
+    jsonify,
+    redirect,
+    url_for,
+    g,
+    stream_with_context,
+)
+from flask.json.provider import JSONProvider
+from functools import wraps, lru_cache
 import json
 from gemini_agent import GeminiAgent
 from db import Database
 import os
 from dotenv import load_dotenv
 import logging
-import sys
+import orjson
 
 load_dotenv()
 
+
+class ORJSONProvider(JSONProvider):
+    """Serve JSON with orjson instead of the stdlib json module"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.secret_key = os.getenv(
     "SECRET_KEY", "your-secret-key-here"
 )  # Use environment variable
@@ -19,21 +42,40 @@ app.secret_key = os.getenv(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-try:
-    # Initialize database
+
+@lru_cache(maxsize=1)
+def get_db():
+    """Create the database on first use in this worker"""
     db = Database()
     logger.info("Database initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize database: {str(e)}")
-    sys.exit(1)
+    return db
+
 
-try:
-    # Initialize agent
+@lru_cache(maxsize=1)
+def get_agent():
+    """Create the agent on first use in this worker"""
     agent = GeminiAgent()
     logger.info("Agent initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize agent: {str(e)}")
-    sys.exit(1)
+    return agent
+
+
+# Workers forked from a process that already built these must build their own
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=get_db.cache_clear)
+    os.register_at_fork(after_in_child=get_agent.cache_clear)
+
+
+@lru_cache(maxsize=None)
+def _cached_page(template):
+    """Render a page once per worker; the templates use no request context"""
+    return render_template(template)
+
+
+def render_page(template):
+    """Serve a static page, re-rendering on every request only in debug mode"""
+    if app.debug:
+        return render_template(template)
+    return _cached_page(template)
 
 
 def login_required(f):
@@ -43,10 +85,13 @@ def login_required(f):
         if not session_token:
             return jsonify({"error": "Authentication required"}), 401
 
-        user = db.get_user_by_token(session_token)
+        user = get_db().get_user_by_token(session_token)
         if not user or not user.get("success"):
             return jsonify({"error": "Invalid session"}), 401
 
+        # Make the authenticated user available to the view
+        g.user = user
+        g.session_token = session_token
         return f(*args, **kwargs)
 
     return decorated_function
@@ -54,17 +99,17 @@ def login_required(f):
 
 @app.route("/")
 def home():
-    return render_template("index.html")
+    return render_page("index.html")
 
 
 @app.route("/login")
 def login_page():
-    return render_template("login.html")
+    return render_page("login.html")
 
 
 @app.route("/register")
 def register_page():
-    return render_template("register.html")
+    return render_page("register.html")
 
 
 @app.route("/api/register", methods=["POST"])
@@ -79,7 +124,7 @@ def register():
             return jsonify({"error": "Missing required fields"}), 400
 
         # Create user and get session token
-        session_token = db.create_user(username, email, password)
+        session_token = get_db().create_user(username, email, password)
         if not session_token:
             return jsonify({"error": "Username or email already exists"}), 400
 
@@ -100,7 +145,7 @@ def login():
             return jsonify({"error": "Missing required fields"}), 400
 
         # Authenticate user and get session token
-        session_token = db.authenticate_user(username, password)
+        session_token = get_db().authenticate_user(username, password)
         if not session_token:
             return jsonify({"error": "Invalid credentials"}), 401
 
@@ -115,28 +160,66 @@ def login():
 def chat():
     """Handle chat messages"""
     try:
-        data = request.get_json()
-        if not data or "message" not in data:
+        try:
+            data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict) or not isinstance(data.get("message"), str):
             return jsonify({"error": "No message provided"}), 400
 
-        # Get session token from request headers
-        session_token = request.headers.get("X-Session-Token")
-        if not session_token:
-            return jsonify({"error": "No session token provided"}), 401
+        # User was already verified by login_required
+        user = g.user
 
-        # Verify user session
-        user = db.get_user_by_token(session_token)
-        if not user["success"]:
-            return jsonify({"error": "Invalid or expired session"}), 401
+        agent = get_agent()
+        # Computed before the turn, while the history still matches the
+        # key the reply gets cached under
+        cache_key = agent.response_cache_key(data["message"], user["user_id"])
 
         # Process message with user context
         response = agent.process_message(data["message"], user_id=user["user_id"])
-        return jsonify(response)
+        resp = jsonify(response)
+        if agent.get_cached_response(cache_key) is not None:
+            resp.set_etag(cache_key)
+            resp.headers["Cache-Control"] = "private, max-age=3600"
+        return resp
 
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
 
+@app.route("/api/chat/stream", methods=["POST"])
+@login_required
+def chat_stream():
+    """Stream the assistant's reply to a chat message as server-sent events"""
+    try:
+        try:
+            data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict) or "message" not in data:
+            return jsonify({"error": "No message provided"}), 400
+
+        pieces = get_agent().stream_message(
+            data["message"], user_id=g.user["user_id"]
+        )
+
+        def events():
+            # Each piece of text is one event; "done" marks the end of the reply
+            for piece in pieces:
+                yield b"data: " + orjson.dumps({"text": piece}) + b"\n\n"
+            yield b"event: done\ndata: {}\n\n"
+
+        return Response(
+            stream_with_context(events()),
+            mimetype="text/event-stream",
+            # Keep proxies from buffering the stream
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    except Exception as e:
+        logger.error(f"Error in chat stream endpoint: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
 if __name__ == "__main__":
     app.run(port=os.getenv("PORT", 5000))
@@ -0,0 +1,14 @@
+import datetime
+import re
+
+# Cheaper than strptime; like strptime it also accepts unpadded "2024-1-5"
+_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})", re.ASCII)
+
+
+def parse_ymd(value: str) -> datetime.date:
+    """Parse a YYYY-MM-DD date as strptime('%Y-%m-%d') would; raises ValueError"""
+    match = _DATE_RE.fullmatch(value)
+    if not match:
+        raise ValueError(f"time data {value!r} does not match format '%Y-%m-%d'")
+    # The date constructor rejects out-of-range months and days
+    return datetime.date(int(match[1]), int(match[2]), int(match[3]))
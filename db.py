@@ -1,12 +1,18 @@
 import sqlite3
+import atexit
+import contextlib
 from datetime import datetime
 from enum import Enum
 import logging
 import threading
-from queue import Queue
+import os
+from pathlib import Path
 import time
+import weakref
 import hashlib
+import hmac
 import secrets
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -16,59 +22,202 @@ class TransactionType(Enum):
     EXPENSE = "expense"
 
 
+# transactions.type_id encoding, indexable by id
+_TYPE_NAMES = (TransactionType.INCOME.value, TransactionType.EXPENSE.value)
+_TYPE_IDS = {name: type_id for type_id, name in enumerate(_TYPE_NAMES)}
+
+# Hashed against when a login names no user, so that costs the same as a
+# wrong password and response times don't reveal which usernames exist
+_DUMMY_SALT = bytes(16)
+
+
+# get_transactions SQL for each (start_date given, end_date given) combination,
+# built once so every call reuses the same text and sqlite3's cached statement
+_TRANSACTIONS_SQL = {
+    (has_start, has_end): f"""
+        SELECT t.id, t.user_id, t.amount_cents, c.name, t.date, t.type_id, t.created_at
+        FROM transactions t JOIN categories c ON c.id = t.category_id
+        WHERE t.user_id = ?{' AND t.date >= ?' if has_start else ''}{' AND t.date < ?' if has_end else ''}
+        ORDER BY t.date DESC
+    """
+    for has_start in (False, True)
+    for has_end in (False, True)
+}
+
+
+class _ThreadConnection:
+    """Holds one thread's connection and closes it once the thread exits"""
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+        # threading.local drops the holder when its thread ends
+        weakref.finalize(self, conn.close)
+
+
 class Database:
     _instance = None
     _lock = threading.Lock()
-    _connection_pool = Queue()
-    _max_connections = 5
-    _connection_timeout = 5  # seconds
+    _session_ttl_us = 24 * 60 * 60 * 1_000_000  # sessions last 24 hours
+    # Maps token digest -> (session expiry in epoch µs, user dict). The cache
+    # is per process: a re-login evicts the replaced token only in the worker
+    # that served it, so other workers may accept it until its entry expires.
+    # The short TTL bounds that revocation window to a minute.
+    _token_cache = TTLCache(maxsize=10_000, ttl=60)
+    _token_cache_lock = threading.Lock()
+
+    _INSERT_CATEGORY_SQL = "INSERT OR IGNORE INTO categories (name) VALUES (?)"
+
+    _INSERT_TRANSACTION_SQL = """
+        INSERT INTO transactions (user_id, amount_cents, category_id, date, type_id)
+        VALUES (?, ?, (SELECT id FROM categories WHERE name = ?), ?, ?)
+    """
+
+    _MONTHLY_SUMMARY_SQL = """
+        SELECT income, expenses, transactions
+        FROM monthly_summary
+        WHERE user_id = ? AND ym = ?
+    """
 
     def __new__(cls, db_path="transactions.db"):
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super(Database, cls).__new__(cls)
                 cls._instance.db_path = db_path
-                cls._instance._initialize_pool()
+                cls._instance._initialize_connections()
                 cls._instance._create_tables()  # Create tables on initialization
+                # The schema only needs checking right after it is created
+                if not cls._instance.verify_database_setup():
+                    cls._instance = None
+                    logger.error("Database setup verification failed")
+                    raise Exception("Database setup verification failed")
+                atexit.register(cls._instance.close)
             return cls._instance
 
-    def _initialize_pool(self):
-        """Initialize the connection pool"""
-        for _ in range(self._max_connections):
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
-            self._connection_pool.put(conn)
-        logger.info(
-            f"Initialized connection pool with {self._max_connections} connections"
+    @classmethod
+    def _reset_after_fork(cls):
+        """Forget the parent's instance so a forked child opens its own connections"""
+        # The inherited connections are abandoned, not closed: closing them
+        # here would touch SQLite state the parent still owns
+        cls._instance = None
+        cls._lock = threading.Lock()
+
+    def _initialize_connections(self):
+        """Set up per-thread connection slots and switch the file to WAL"""
+        # Each thread lazily opens its own reader and writer connection, so
+        # no connection is ever shared and no pool lock is taken per call
+        self._tls = threading.local()
+        self._connections = weakref.WeakSet()
+        self._connections_lock = threading.Lock()
+        self._readonly_uri = f"{Path(self.db_path).absolute().as_uri()}?mode=ro"
+
+        # WAL lets readers proceed alongside the writer; the journal mode is
+        # persistent, so it only needs setting once per file
+        self._get_connection().execute("PRAGMA journal_mode=WAL")
+        logger.info("Initialized per-thread database connections")
+
+    def _connect(self, database, uri=False):
+        """Open a connection with the per-connection PRAGMAs applied"""
+        conn = sqlite3.connect(database, uri=uri, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # NORMAL sync is durable in WAL mode without an fsync on every commit
+        conn.executescript(
+            """
+            PRAGMA synchronous=NORMAL;
+            PRAGMA mmap_size=268435456;
+            PRAGMA cache_size=-20000;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA foreign_keys=ON;
+            PRAGMA busy_timeout=5000;
+            """
         )
-
-    def _get_connection(self):
-        """Get a connection from the pool with timeout"""
+        return conn
+
+    def _get_connection(self, readonly=False):
+        """Get this thread's reader or writer connection, opening it on first use"""
+        slot = "reader" if readonly else "writer"
+        holder = getattr(self._tls, slot, None)
+        if holder is None:
+            if readonly:
+                conn = self._connect(self._readonly_uri, uri=True)
+            else:
+                conn = self._connect(self.db_path)
+                # Autocommit mode: write methods open BEGIN IMMEDIATE
+                # themselves so the write lock is taken upfront instead of at
+                # commit time; concurrent writers wait on busy_timeout
+                conn.isolation_level = None
+            holder = _ThreadConnection(conn)
+            setattr(self._tls, slot, holder)
+            with self._connections_lock:
+                self._connections.add(holder)
+        return holder.conn
+
+    def _return_connection(self, conn, readonly=False):
+        """Connections stay with their thread, so there is nothing to return"""
+
+    @contextlib.contextmanager
+    def _conn(self, readonly=False):
+        """Borrow this thread's connection for the duration of a with block"""
+        conn = self._get_connection(readonly)
         try:
-            conn = self._connection_pool.get(timeout=self._connection_timeout)
-            return conn
-        except Queue.Empty:
-            logger.error("Connection pool timeout")
-            raise Exception("Database connection timeout")
+            yield conn
+        finally:
+            self._return_connection(conn, readonly)
+
+    def close(self):
+        """Close every thread's connections (registered with atexit)"""
+        with self._lock:
+            # Leave a replacement instance alone if this one was already closed
+            if Database._instance is not self:
+                return
+            # Refresh planner statistics so the (user_id, ym) and
+            # (user_id, date) indexes keep being picked as the data grows
+            try:
+                self._get_connection().execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                logger.error(f"Error optimizing database: {str(e)}")
+            with self._connections_lock:
+                for holder in list(self._connections):
+                    holder.conn.close()
+            # The next Database() starts over with fresh connections
+            Database._instance = None
+        logger.info("All database connections closed")
+
+    @staticmethod
+    def _hash_password(password: str, salt: bytes) -> bytes:
+        """Derive a salted scrypt hash of a password (~50-100 ms per call by design)"""
+        return hashlib.scrypt(
+            password.encode(),
+            salt=salt,
+            n=2**15,
+            r=8,
+            p=1,
+            maxmem=64 * 1024 * 1024,
+            dklen=32,
+        )
 
-    def _return_connection(self, conn):
-        """Return a connection to the pool"""
-        self._connection_pool.put(conn)
+    @staticmethod
+    def _hash_token(session_token: str) -> bytes:
+        """Hash a session token for storage and lookup"""
+        return hashlib.blake2b(session_token.encode(), digest_size=16).digest()
 
     def _create_tables(self):
         """Create the necessary database tables if they don't exist."""
-        try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
+        with self._conn() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
 
-                # Create users table
-                cursor.execute(
+                # Create users table (session_token holds a digest of the token;
+                # created_at and last_login are epoch microseconds)
+                conn.execute(
                     """
                     CREATE TABLE IF NOT EXISTS users (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         username TEXT UNIQUE NOT NULL,
                         email TEXT UNIQUE NOT NULL,
-                        password_hash TEXT NOT NULL,
+                        password_hash BLOB NOT NULL,
+                        password_salt BLOB,
                         session_token TEXT UNIQUE,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         last_login TIMESTAMP
@@ -76,24 +225,181 @@ class Database:
                     """
                 )
 
-                # Create transactions table
-                cursor.execute(
+                # Databases created before salted hashing lack password_salt
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+                if "password_salt" not in columns:
+                    conn.execute("ALTER TABLE users ADD COLUMN password_salt BLOB")
+
+                # Transactions used to store amounts as REAL and, before that,
+                # category and type as text on every row; rebuild such tables
+                # into the normalized, integer-cents layout
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}
+                migrate = "amount" in columns
+                if migrate:
+                    conn.execute("ALTER TABLE transactions RENAME TO transactions_old")
+                    # Its totals are in REAL dollars; rebuilt from the new rows
+                    conn.execute("DROP TABLE IF EXISTS monthly_summary")
+
+                # Category names are stored once and referenced by id
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS categories (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT UNIQUE NOT NULL
+                    )
+                    """
+                )
+
+                # Create transactions table (amounts in integer cents;
+                # type_id: 0 = income, 1 = expense)
+                conn.execute(
                     """
                     CREATE TABLE IF NOT EXISTS transactions (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         user_id INTEGER NOT NULL,
-                        amount REAL NOT NULL,
-                        category TEXT NOT NULL,
+                        amount_cents INTEGER NOT NULL,
+                        category_id INTEGER NOT NULL,
                         date TEXT NOT NULL,
-                        transaction_type TEXT NOT NULL,
+                        type_id INTEGER NOT NULL CHECK (type_id IN (0, 1)),
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users (id)
+                        ym INTEGER GENERATED ALWAYS AS (
+                            CAST(substr(date, 1, 4) AS INTEGER) * 100
+                            + CAST(substr(date, 6, 2) AS INTEGER)
+                        ) VIRTUAL,
+                        FOREIGN KEY (user_id) REFERENCES users (id),
+                        FOREIGN KEY (category_id) REFERENCES categories (id)
+                    )
+                    """
+                )
+
+                if migrate and "category" in columns:
+                    conn.execute(
+                        """
+                        INSERT OR IGNORE INTO categories (name)
+                        SELECT DISTINCT category FROM transactions_old
+                        """
+                    )
+                    conn.execute(
+                        """
+                        INSERT INTO transactions
+                            (id, user_id, amount_cents, category_id, date, type_id, created_at)
+                        SELECT t.id, t.user_id, CAST(round(t.amount * 100) AS INTEGER),
+                            c.id, t.date,
+                            CASE t.transaction_type WHEN 'income' THEN 0 ELSE 1 END,
+                            t.created_at
+                        FROM transactions_old t JOIN categories c ON c.name = t.category
+                        """
+                    )
+                elif migrate:
+                    conn.execute(
+                        """
+                        INSERT INTO transactions
+                            (id, user_id, amount_cents, category_id, date, type_id, created_at)
+                        SELECT id, user_id, CAST(round(amount * 100) AS INTEGER),
+                            category_id, date, type_id, created_at
+                        FROM transactions_old
+                        """
                     )
+                if migrate:
+                    conn.execute("DROP TABLE transactions_old")
+                    logger.info("Migrated transactions to the integer-cents layout")
+
+                # Per-user monthly totals, kept current by the triggers below
+                # so summaries are a primary-key lookup instead of an aggregate
+                backfill = not conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='monthly_summary'"
+                ).fetchone()
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS monthly_summary (
+                        user_id INTEGER NOT NULL,
+                        ym INTEGER NOT NULL,
+                        income INTEGER NOT NULL DEFAULT 0,
+                        expenses INTEGER NOT NULL DEFAULT 0,
+                        transactions INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (user_id, ym)
+                    ) WITHOUT ROWID
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TRIGGER IF NOT EXISTS trg_tx_summary_insert
+                    AFTER INSERT ON transactions
+                    BEGIN
+                        INSERT INTO monthly_summary (user_id, ym, income, expenses, transactions)
+                        VALUES (
+                            new.user_id,
+                            new.ym,
+                            CASE WHEN new.type_id = 0 THEN new.amount_cents ELSE 0 END,
+                            CASE WHEN new.type_id = 1 THEN new.amount_cents ELSE 0 END,
+                            1
+                        )
+                        ON CONFLICT (user_id, ym) DO UPDATE SET
+                            income = income + excluded.income,
+                            expenses = expenses + excluded.expenses,
+                            transactions = transactions + 1;
+                    END
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TRIGGER IF NOT EXISTS trg_tx_summary_delete
+                    AFTER DELETE ON transactions
+                    BEGIN
+                        UPDATE monthly_summary SET
+                            income = income - CASE WHEN old.type_id = 0 THEN old.amount_cents ELSE 0 END,
+                            expenses = expenses - CASE WHEN old.type_id = 1 THEN old.amount_cents ELSE 0 END,
+                            transactions = transactions - 1
+                        WHERE user_id = old.user_id AND ym = old.ym;
+                        DELETE FROM monthly_summary
+                        WHERE user_id = old.user_id AND ym = old.ym AND transactions = 0;
+                    END
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TRIGGER IF NOT EXISTS trg_tx_summary_update
+                    AFTER UPDATE OF user_id, amount_cents, date, type_id ON transactions
+                    BEGIN
+                        UPDATE monthly_summary SET
+                            income = income - CASE WHEN old.type_id = 0 THEN old.amount_cents ELSE 0 END,
+                            expenses = expenses - CASE WHEN old.type_id = 1 THEN old.amount_cents ELSE 0 END,
+                            transactions = transactions - 1
+                        WHERE user_id = old.user_id AND ym = old.ym;
+                        DELETE FROM monthly_summary
+                        WHERE user_id = old.user_id AND ym = old.ym AND transactions = 0;
+                        INSERT INTO monthly_summary (user_id, ym, income, expenses, transactions)
+                        VALUES (
+                            new.user_id,
+                            new.ym,
+                            CASE WHEN new.type_id = 0 THEN new.amount_cents ELSE 0 END,
+                            CASE WHEN new.type_id = 1 THEN new.amount_cents ELSE 0 END,
+                            1
+                        )
+                        ON CONFLICT (user_id, ym) DO UPDATE SET
+                            income = income + excluded.income,
+                            expenses = expenses + excluded.expenses,
+                            transactions = transactions + 1;
+                    END
                     """
                 )
+                if backfill:
+                    conn.execute(
+                        """
+                        INSERT INTO monthly_summary (user_id, ym, income, expenses, transactions)
+                        SELECT
+                            user_id,
+                            ym,
+                            SUM(CASE WHEN type_id = 0 THEN amount_cents ELSE 0 END),
+                            SUM(CASE WHEN type_id = 1 THEN amount_cents ELSE 0 END),
+                            COUNT(*)
+                        FROM transactions
+                        GROUP BY user_id, ym
+                        """
+                    )
 
                 # Create exchange_rates table
-                cursor.execute(
+                conn.execute(
                     """
                     CREATE TABLE IF NOT EXISTS exchange_rates (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -107,11 +413,27 @@ class Database:
                     """
                 )
 
+                # Summaries are served by monthly_summary's primary key, so
+                # the covering (user_id, ym) index no longer earns its write
+                # cost. Session token, category name and exchange-rate
+                # lookups are served by the indexes behind their UNIQUE
+                # constraints.
+                conn.execute("DROP INDEX IF EXISTS idx_tx_user_ym")
+
+                # Per-user date range lookups (transaction lists)
+                conn.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_tx_user_date
+                    ON transactions (user_id, date)
+                    """
+                )
+
                 conn.commit()
                 logger.info("Database tables created successfully")
-        except Exception as e:
-            logger.error(f"Error creating database tables: {str(e)}")
-            raise
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error creating database tables: {str(e)}")
+                raise
 
     def create_user(self, username: str, email: str, password: str) -> str:
         """
@@ -125,39 +447,42 @@ class Database:
         Returns:
             str: Session token if successful, None if failed
         """
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            password_hash = hashlib.sha256((password).encode()).hexdigest()
+        # Hash outside the connection so the writer isn't held during scrypt
+        password_salt = secrets.token_bytes(16)
+        password_hash = self._hash_password(password, password_salt)
 
-            # Generate session token
-            session_token = secrets.token_hex(32)
+        # Generate session token
+        session_token = secrets.token_hex(32)
 
-            cursor.execute(
-                """
-                INSERT INTO users (username, email, password_hash, session_token, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """,
-                (
-                    username,
-                    email,
-                    password_hash,
-                    session_token,
-                    datetime.now().isoformat(),
-                ),
-            )
-
-            conn.commit()
-            logger.info(f"Created new user: {username}")
-            return session_token
-        except sqlite3.IntegrityError as e:
-            logger.error(f"Error creating user: {str(e)}")
-            return None
-        except Exception as e:
-            logger.error(f"Error creating user: {str(e)}")
-            return None
-        finally:
-            self._return_connection(conn)
+        with self._conn() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    """
+                    INSERT INTO users (username, email, password_hash, password_salt, session_token, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                    (
+                        username,
+                        email,
+                        password_hash,
+                        password_salt,
+                        self._hash_token(session_token),
+                        time.time_ns() // 1000,
+                    ),
+                )
+
+                conn.commit()
+                logger.info(f"Created new user: {username}")
+                return session_token
+            except sqlite3.IntegrityError as e:
+                conn.rollback()
+                logger.error(f"Error creating user: {str(e)}")
+                return None
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error creating user: {str(e)}")
+                return None
 
     def authenticate_user(self, username: str, password: str) -> str:
         """
@@ -170,43 +495,82 @@ class Database:
         Returns:
             str: Session token if successful, None if failed
         """
-        conn = self._get_connection()
         try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, username, password_hash FROM users WHERE username = ?",
-                (username,),
-            )
-            user = cursor.fetchone()
+            with self._conn(readonly=True) as conn:
+                user = conn.execute(
+                    "SELECT id, username, password_hash, password_salt FROM users WHERE username = ?",
+                    (username,),
+                ).fetchone()
 
             if not user:
+                self._hash_password(password, _DUMMY_SALT)
                 return None
 
-            # Verify password
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            if password_hash != user["password_hash"]:
+            # Verify password without holding any connection
+            if user["password_salt"] is None:
+                # Legacy unsalted SHA-256 hash
+                password_hash = hashlib.sha256(password.encode()).digest()
+            else:
+                password_hash = self._hash_password(password, user["password_salt"])
+            # Hashes are stored as raw digests; older rows hold hex text and
+            # are rewritten as raw bytes by the UPDATE below
+            stored_hash = user["password_hash"]
+            if isinstance(stored_hash, str):
+                stored_hash = bytes.fromhex(stored_hash)
+            if not hmac.compare_digest(password_hash, stored_hash):
                 return None
 
+            # Upgrade legacy hashes now that we know the password
+            password_salt = user["password_salt"]
+            if password_salt is None:
+                password_salt = secrets.token_bytes(16)
+                password_hash = self._hash_password(password, password_salt)
+
             # Generate new session token
             session_token = secrets.token_hex(32)
 
             # Update user's session token and last login
-            cursor.execute(
-                """
-                UPDATE users 
-                SET session_token = ?, last_login = ?
-                WHERE id = ?
-            """,
-                (session_token, datetime.now().isoformat(), user["id"]),
-            )
-            conn.commit()
+            with self._conn() as conn:
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute(
+                        """
+                        UPDATE users 
+                        SET session_token = ?, last_login = ?, password_hash = ?, password_salt = ?
+                        WHERE id = ?
+                    """,
+                        (
+                            self._hash_token(session_token),
+                            time.time_ns() // 1000,
+                            password_hash,
+                            password_salt,
+                            user["id"],
+                        ),
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+            # The previous token was just replaced; stop serving it from this
+            # worker's cache (other workers drop it within the cache TTL)
+            self._evict_user_tokens(user["id"])
 
             return session_token
         except Exception as e:
             logger.error(f"Error authenticating user: {str(e)}")
             return None
-        finally:
-            self._return_connection(conn)
+
+    def _evict_user_tokens(self, user_id: int):
+        """Drop cached session lookups belonging to a user"""
+        with self._token_cache_lock:
+            stale = [
+                token_hash
+                for token_hash, (_, result) in self._token_cache.items()
+                if result["user_id"] == user_id
+            ]
+            for token_hash in stale:
+                self._token_cache.pop(token_hash, None)
 
     def get_user_by_token(self, session_token: str) -> dict:
         """
@@ -218,38 +582,54 @@ class Database:
         Returns:
             dict: User information with success status
         """
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT id, username, email 
-                FROM users 
-                WHERE session_token = ? AND last_login > datetime('now', '-24 hours')
-                """,
-                (session_token,),
-            )
-            user = cursor.fetchone()
-
-            if not user:
-                return {"success": False, "error": "Invalid or expired session token"}
-
-            return {
-                "success": True,
-                "user_id": user["id"],
-                "username": user["username"],
-                "email": user["email"],
-            }
-        except Exception as e:
-            logger.error(f"Error getting user: {str(e)}")
-            return {"success": False, "error": str(e)}
-        finally:
-            self._return_connection(conn)
+        token_hash = self._hash_token(session_token)
+        now = time.time_ns() // 1000
+        with self._token_cache_lock:
+            cached = self._token_cache.get(token_hash)
+        if cached is not None:
+            expires_at, result = cached
+            if now < expires_at:
+                return result
+            with self._token_cache_lock:
+                self._token_cache.pop(token_hash, None)
+            return {"success": False, "error": "Invalid or expired session token"}
+
+        with self._conn(readonly=True) as conn:
+            try:
+                user = conn.execute(
+                    """
+                    SELECT id, username, email, last_login
+                    FROM users 
+                    WHERE session_token = ?
+                    """,
+                    (token_hash,),
+                ).fetchone()
+
+                # Expiry is checked here rather than in SQL so cache hits can
+                # apply it without touching the database
+                if not user or user["last_login"] is None:
+                    return {"success": False, "error": "Invalid or expired session token"}
+                expires_at = user["last_login"] + self._session_ttl_us
+                if now >= expires_at:
+                    return {"success": False, "error": "Invalid or expired session token"}
+
+                result = {
+                    "success": True,
+                    "user_id": user["id"],
+                    "username": user["username"],
+                    "email": user["email"],
+                }
+                with self._token_cache_lock:
+                    self._token_cache[token_hash] = (expires_at, result)
+                return result
+            except Exception as e:
+                logger.error(f"Error getting user: {str(e)}")
+                return {"success": False, "error": str(e)}
 
     def add_transaction(
         self,
         user_id: int,
-        amount: float,
+        amount_cents: int,
         category: str,
         date: str,
         transaction_type: str,
@@ -259,7 +639,7 @@ class Database:
 
         Args:
             user_id (int): The ID of the user making the transaction
-            amount (float): The amount of the transaction
+            amount_cents (int): The amount of the transaction in cents
             category (str): The category of the transaction
             date (str): The date of the transaction in YYYY-MM-DD format
             transaction_type (str): The type of transaction ('income' or 'expense')
@@ -267,71 +647,125 @@ class Database:
         Returns:
             int: The ID of the newly created transaction
         """
-        try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    INSERT INTO transactions (user_id, amount, category, date, transaction_type)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (user_id, amount, category, date, transaction_type),
+        with self._conn() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(self._INSERT_CATEGORY_SQL, (category,))
+                cursor = conn.execute(
+                    self._INSERT_TRANSACTION_SQL,
+                    (user_id, amount_cents, category, date, _TYPE_IDS[transaction_type]),
                 )
                 conn.commit()
                 transaction_id = cursor.lastrowid
                 self.logger.info(
-                    f"Added {transaction_type} transaction: {amount} in {category} for user {user_id}"
+                    f"Added {transaction_type} transaction: {amount_cents} cents in {category} for user {user_id}"
                 )
                 return transaction_id
-        except Exception as e:
-            self.logger.error(f"Error adding transaction: {str(e)}")
-            raise
+            except Exception as e:
+                conn.rollback()
+                self.logger.error(f"Error adding transaction: {str(e)}")
+                raise
+
+    def add_transactions_bulk(self, rows: list) -> list:
+        """
+        Add many transactions in a single database transaction.
+
+        Args:
+            rows (list): Tuples of (user_id, amount_cents, category, date, transaction_type)
+
+        Returns:
+            list: The IDs of the newly created transactions, in input order
+        """
+        with self._conn() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    self._INSERT_CATEGORY_SQL, {(row[2],) for row in rows}
+                )
+                count = conn.executemany(
+                    self._INSERT_TRANSACTION_SQL,
+                    (
+                        (user_id, amount_cents, category, date, _TYPE_IDS[transaction_type])
+                        for user_id, amount_cents, category, date, transaction_type in rows
+                    ),
+                ).rowcount
+                # The write lock is held throughout, so the new rowids are
+                # consecutive and end at the last one inserted
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                conn.commit()
+                self.logger.info(f"Added {count} transactions in bulk")
+                return list(range(last_id - count + 1, last_id + 1)) if count > 0 else []
+            except Exception as e:
+                conn.rollback()
+                self.logger.error(f"Error adding transactions in bulk: {str(e)}")
+                raise
 
     def get_transactions(
         self, user_id: int, start_date: str = None, end_date: str = None
-    ):
+    ) -> list:
         """
-        Get transactions within a date range
+        Get transactions within a half-open date range [start_date, end_date)
 
         Args:
             user_id (int): ID of the user
             start_date (str, optional): Start date in YYYY-MM-DD format
-            end_date (str, optional): End date in YYYY-MM-DD format
+            end_date (str, optional): Exclusive end date in YYYY-MM-DD format
+                (e.g. the first day of the next month)
 
         Returns:
-            list: List of transaction dictionaries
+            list: Transaction dictionaries, newest first
         """
-        query = "SELECT * FROM transactions WHERE user_id = ?"
-        params = [user_id]
+        return list(self.iter_transactions(user_id, start_date, end_date))
 
-        if start_date or end_date:
-            conditions = []
-            if start_date:
-                conditions.append("date >= ?")
-                params.append(start_date)
-            if end_date:
-                conditions.append("date <= ?")
-                params.append(end_date)
-            query += " AND " + " AND ".join(conditions)
+    def iter_transactions(
+        self,
+        user_id: int,
+        start_date: str = None,
+        end_date: str = None,
+        chunk: int = 1000,
+    ):
+        """
+        Stream transactions within a half-open date range [start_date, end_date)
 
-        query += " ORDER BY date DESC"
+        Args:
+            user_id (int): ID of the user
+            start_date (str, optional): Start date in YYYY-MM-DD format
+            end_date (str, optional): Exclusive end date in YYYY-MM-DD format
+            chunk (int, optional): Rows fetched from SQLite per batch
 
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            transactions = []
-            for row in cursor.fetchall():
-                transaction = dict(row)
-                transaction["type"] = TransactionType(transaction["transaction_type"])
-                transactions.append(transaction)
-            logger.info(f"Retrieved {len(transactions)} transactions")
-            return transactions
-        except Exception as e:
-            logger.error(f"Error retrieving transactions: {str(e)}")
-            raise
-        finally:
-            self._return_connection(conn)
+        Returns:
+            Iterator[dict]: Transaction dictionaries, newest first
+        """
+        query = _TRANSACTIONS_SQL[bool(start_date), bool(end_date)]
+        params = [user_id]
+        if start_date:
+            params.append(start_date)
+        if end_date:
+            params.append(end_date)
+
+        with self._conn(readonly=True) as conn:
+            try:
+                cursor = conn.execute(query, params)
+                cursor.arraysize = chunk
+                count = 0
+                # Yield rows batch by batch so callers that only aggregate or
+                # page through results never hold the whole set in memory
+                while rows := cursor.fetchmany():
+                    for row in rows:
+                        yield {
+                            "id": row[0],
+                            "user_id": row[1],
+                            "amount_cents": row[2],
+                            "category": row[3],
+                            "date": row[4],
+                            "transaction_type": _TYPE_NAMES[row[5]],
+                            "created_at": row[6],
+                        }
+                    count += len(rows)
+                logger.info(f"Retrieved {count} transactions")
+            except Exception as e:
+                logger.error(f"Error retrieving transactions: {str(e)}")
+                raise
 
     def get_monthly_summary(self, user_id: int, year: int, month: int):
         """
@@ -344,137 +778,154 @@ class Database:
 
         Returns:
             dict: Summary of transactions including income, expenses, and balance
+                in cents
+        """
+        with self._conn(readonly=True) as conn:
+            try:
+                result = conn.execute(
+                    self._MONTHLY_SUMMARY_SQL, (user_id, year * 100 + month)
+                ).fetchone()
+                # Months without transactions have no summary row
+                income, expenses, transactions = result or (0, 0, 0)
+
+                summary = {
+                    "income": income,
+                    "expenses": expenses,
+                    "balance": income - expenses,
+                    "transactions": transactions,
+                }
+                logger.info(f"Generated monthly summary for {year}-{month:02d}")
+                return summary
+            except Exception as e:
+                logger.error(f"Error generating monthly summary: {str(e)}")
+                raise
+
+    def get_monthly_summaries(
+        self, user_ids: list, start: tuple, end: tuple
+    ) -> dict:
         """
-        start_date = f"{year}-{month:02d}-01"
-        if month == 12:
-            end_date = f"{year + 1}-01-01"
-        else:
-            end_date = f"{year}-{month + 1:02d}-01"
+        Get monthly summaries for several users and months in one query
 
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT 
-                    SUM(CASE WHEN transaction_type = 'income' THEN amount ELSE 0 END) as income,
-                    SUM(CASE WHEN transaction_type = 'expense' THEN amount ELSE 0 END) as expenses,
-                    COUNT(*) as transactions
-                FROM transactions
-                WHERE user_id = ? AND date >= ? AND date < ?
-                """,
-                (user_id, start_date, end_date),
-            )
-
-            result = cursor.fetchone()
-            income = result[0] or 0
-            expenses = result[1] or 0
-            transactions = result[2] or 0
-
-            summary = {
-                "income": income,
-                "expenses": expenses,
-                "balance": income - expenses,
-                "transactions": transactions,
-            }
-            logger.info(f"Generated monthly summary for {year}-{month:02d}")
-            return summary
-        except Exception as e:
-            logger.error(f"Error generating monthly summary: {str(e)}")
-            raise
-        finally:
-            self._return_connection(conn)
+        Args:
+            user_ids (list): IDs of the users
+            start (tuple): First (year, month) to include
+            end (tuple): Last (year, month) to include
+
+        Returns:
+            dict: Summaries keyed by (user_id, year, month), amounts in cents;
+                months without transactions are omitted
+        """
+        if not user_ids:
+            return {}
+
+        placeholders = ",".join("?" * len(user_ids))
+        query = f"""
+            SELECT user_id, ym, income, expenses, transactions
+            FROM monthly_summary
+            WHERE user_id IN ({placeholders}) AND ym BETWEEN ? AND ?
+        """
+        params = [*user_ids, start[0] * 100 + start[1], end[0] * 100 + end[1]]
+
+        with self._conn(readonly=True) as conn:
+            try:
+                summaries = {}
+                for user_id, ym, income, expenses, transactions in conn.execute(
+                    query, params
+                ):
+                    summaries[(user_id, ym // 100, ym % 100)] = {
+                        "income": income,
+                        "expenses": expenses,
+                        "balance": income - expenses,
+                        "transactions": transactions,
+                    }
+                logger.info(
+                    f"Generated {len(summaries)} monthly summaries for {len(user_ids)} users"
+                )
+                return summaries
+            except Exception as e:
+                logger.error(f"Error generating monthly summaries: {str(e)}")
+                raise
 
     def verify_database_setup(self):
         """
         Verify that all required tables exist and have the correct structure
         """
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-
-            # Check users table
-            cursor.execute(
+        with self._conn(readonly=True) as conn:
+            try:
+                # Check users table
+                if not conn.execute(
+                    """
+                    SELECT name FROM sqlite_master 
+                    WHERE type='table' AND name='users'
                 """
-                SELECT name FROM sqlite_master 
-                WHERE type='table' AND name='users'
-            """
-            )
-            if not cursor.fetchone():
-                self.logger.error("Users table does not exist")
-                return False
+                ).fetchone():
+                    logger.error("Users table does not exist")
+                    return False
 
-            # Check transactions table
-            cursor.execute(
+                # Check transactions table
+                if not conn.execute(
+                    """
+                    SELECT name FROM sqlite_master 
+                    WHERE type='table' AND name='transactions'
                 """
-                SELECT name FROM sqlite_master 
-                WHERE type='table' AND name='transactions'
-            """
-            )
-            if not cursor.fetchone():
-                self.logger.error("Transactions table does not exist")
-                return False
+                ).fetchone():
+                    logger.error("Transactions table does not exist")
+                    return False
+
+                # Verify users table structure
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+                required_columns = {
+                    "id",
+                    "username",
+                    "email",
+                    "password_hash",
+                    "password_salt",
+                    "session_token",
+                    "created_at",
+                    "last_login",
+                }
+                if not required_columns.issubset(columns):
+                    logger.error(
+                        f"Users table missing required columns: {required_columns - columns}"
+                    )
+                    return False
+
+                # Verify transactions table structure
+                columns = {
+                    row[1] for row in conn.execute("PRAGMA table_info(transactions)")
+                }
+                required_columns = {
+                    "id",
+                    "user_id",
+                    "amount_cents",
+                    "category_id",
+                    "date",
+                    "type_id",
+                    "created_at",
+                }
+                if not required_columns.issubset(columns):
+                    logger.error(
+                        f"Transactions table missing required columns: {required_columns - columns}"
+                    )
+                    return False
 
-            # Verify users table structure
-            cursor.execute("PRAGMA table_info(users)")
-            columns = {row[1] for row in cursor.fetchall()}
-            required_columns = {
-                "id",
-                "username",
-                "email",
-                "password_hash",
-                "session_token",
-                "created_at",
-                "last_login",
-            }
-            if not required_columns.issubset(columns):
-                self.logger.error(
-                    f"Users table missing required columns: {required_columns - columns}"
-                )
-                return False
+                logger.info("Database setup verified successfully")
+                return True
 
-            # Verify transactions table structure
-            cursor.execute("PRAGMA table_info(transactions)")
-            columns = {row[1] for row in cursor.fetchall()}
-            required_columns = {
-                "id",
-                "user_id",
-                "amount",
-                "category",
-                "date",
-                "transaction_type",
-                "created_at",
-            }
-            if not required_columns.issubset(columns):
-                self.logger.error(
-                    f"Transactions table missing required columns: {required_columns - columns}"
-                )
+            except Exception as e:
+                logger.error(f"Error verifying database setup: {str(e)}")
                 return False
 
-            self.logger.info("Database setup verified successfully")
-            return True
-
-        except Exception as e:
-            self.logger.error(f"Error verifying database setup: {str(e)}")
-            return False
-        finally:
-            self._return_connection(conn)
-
     def __init__(self, db_path="transactions.db"):
-        """Initialize database and verify setup"""
+        """Initialize database (schema setup and verification run once in __new__)"""
+        # __init__ runs on every Database() call, but the singleton only
+        # needs setting up once
+        if getattr(self, "_initialized", False):
+            return
 
         self.logger = logging.getLogger(__name__)
         self.logger.info("Initialized Database")
-        if not self.verify_database_setup():
-            logger.error("Database setup verification failed")
-            raise Exception("Database setup verification failed")
-
-    def __del__(self):
-        """Close all database connections when object is destroyed"""
-        while not self._connection_pool.empty():
-            conn = self._connection_pool.get()
-            conn.close()
-        logger.info("All database connections closed")
+        self._initialized = True
 
     def get_exchange_rate(self, from_currency: str, to_currency: str) -> dict:
         """
@@ -487,39 +938,36 @@ class Database:
         Returns:
             dict: Exchange rate information or None if not found
         """
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT rate, date 
-                FROM exchange_rates 
-                WHERE from_currency = ? AND to_currency = ? 
-                ORDER BY date DESC 
-                LIMIT 1
-                """,
-                (from_currency.upper(), to_currency.upper()),
-            )
-            result = cursor.fetchone()
+        with self._conn(readonly=True) as conn:
+            try:
+                result = conn.execute(
+                    """
+                    SELECT rate, date 
+                    FROM exchange_rates 
+                    WHERE from_currency = ? AND to_currency = ? 
+                    ORDER BY date DESC 
+                    LIMIT 1
+                    """,
+                    (from_currency.upper(), to_currency.upper()),
+                ).fetchone()
 
-            if not result:
-                return None
+                if not result:
+                    return None
 
-            return {
-                "rate": result["rate"],
-                "date": result["date"],
-            }
-        except Exception as e:
-            logger.error(f"Error getting exchange rate: {str(e)}")
-            raise
-        finally:
-            self._return_connection(conn)
+                return {
+                    "rate": result["rate"],
+                    "date": result["date"],
+                }
+            except Exception as e:
+                logger.error(f"Error getting exchange rate: {str(e)}")
+                raise
 
     def add_exchange_rate(
         self, from_currency: str, to_currency: str, rate: float, date: str = None
     ) -> bool:
         """
-        Add a new exchange rate to the database.
+        Add an exchange rate to the database, replacing any rate already
+        stored for the same pair and date.
 
         Args:
             from_currency (str): The source currency code
@@ -533,23 +981,28 @@ class Database:
         if not date:
             date = datetime.now().strftime("%Y-%m-%d")
 
-        conn = self._get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO exchange_rates (from_currency, to_currency, rate, date)
-                VALUES (?, ?, ?, ?)
-                """,
-                (from_currency.upper(), to_currency.upper(), rate, date),
-            )
-            conn.commit()
-            logger.info(
-                f"Added exchange rate: {from_currency} to {to_currency} = {rate}"
-            )
-            return True
-        except Exception as e:
-            logger.error(f"Error adding exchange rate: {str(e)}")
-            return False
-        finally:
-            self._return_connection(conn)
+        with self._conn() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    """
+                    INSERT INTO exchange_rates (from_currency, to_currency, rate, date)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (from_currency, to_currency, date)
+                    DO UPDATE SET rate = excluded.rate
+                    """,
+                    (from_currency.upper(), to_currency.upper(), rate, date),
+                )
+                conn.commit()
+                logger.info(
+                    f"Added exchange rate: {from_currency} to {to_currency} = {rate}"
+                )
+                return True
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error adding exchange rate: {str(e)}")
+                return False
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Database._reset_after_fork)
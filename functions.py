@@ -1,5 +1,13 @@
 import datetime
+import functools
+import inspect
+import math
+import os
+import re
+import threading
+import time
 from db import Database, TransactionType
+from dates import parse_ymd
 
 # from storage import FileStorage, TransactionType
 from api import ExchangeRateAPI
@@ -7,15 +15,86 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# ISO 4217 currency codes are three ASCII letters
+_CURRENCY_RE = re.compile(r"[A-Z]{3}", re.ASCII)
+
+# (next local midnight as epoch seconds, today's date as YYYY-MM-DD)
+_today_cache = (0.0, "")
+
+
+_USER_ID_ERROR = {"success": False, "error": "User ID is required for transactions"}
+
+
+def _require_user_id(method):
+    """Return the missing-user error instead of calling the method without a user_id"""
+    position = list(inspect.signature(method).parameters).index("user_id")
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        user_id = kwargs.get("user_id")
+        if user_id is None and len(args) > position:
+            user_id = args[position]
+        if not user_id:
+            # Copied so a caller can't alter the shared error
+            return dict(_USER_ID_ERROR)
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+def _parse_date(value: str) -> str:
+    """Validate a YYYY-MM-DD date and return it zero-padded; raises ValueError"""
+    return parse_ymd(value).isoformat()
+
+
+def _to_cents(amount) -> int:
+    """Convert an amount to whole cents; anything that isn't a finite number is 0"""
+    if not isinstance(amount, (int, float)) or not math.isfinite(amount):
+        return 0
+    return int(round(amount * 100))
+
+
+def _today() -> str:
+    """Today's local date as YYYY-MM-DD, recomputed only once per day"""
+    global _today_cache
+    next_midnight, today = _today_cache
+    if time.time() >= next_midnight:
+        date = datetime.date.today()
+        next_midnight = datetime.datetime.combine(
+            date + datetime.timedelta(days=1), datetime.time()
+        ).timestamp()
+        today = date.isoformat()
+        _today_cache = (next_midnight, today)
+    return today
+
 
 class FinancialFunctions:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """Return the process-wide FinancialFunctions, creating it on first use"""
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def _reset_after_fork(cls):
+        """Forget the parent's instance so a forked child builds its own API client"""
+        cls._instance = None
+        cls._lock = threading.Lock()
+
     def __init__(self):
         self.db = Database()
         # self.storage = FileStorage()
-        self.exchange_api = ExchangeRateAPI()
+        # Last-good rates persist in the database as an upstream-outage fallback
+        self.exchange_api = ExchangeRateAPI(store=self.db)
         self.logger = logging.getLogger(__name__)
         self.logger.info("Initialized FinancialFunctions")
 
+    @_require_user_id
     def log_expense(
         self, amount: float, category: str, date: str = None, user_id: int = None
     ) -> dict:
@@ -32,17 +111,9 @@ class FinancialFunctions:
             dict: Result of the operation
         """
         try:
-            if not user_id:
-                return {
-                    "success": False,
-                    "error": "User ID is required for transactions",
-                }
-
-            if not date:
-                date = datetime.datetime.now().strftime("%Y-%m-%d")
-
-            # Validate amount
-            if not isinstance(amount, (int, float)) or amount <= 0:
+            # Validate amount; stored as integer cents so sums stay exact
+            amount_cents = _to_cents(amount)
+            if amount_cents <= 0:
                 return {"success": False, "error": "Amount must be a positive number"}
 
             # Validate category
@@ -52,32 +123,37 @@ class FinancialFunctions:
                     "error": "Category must be a non-empty string",
                 }
 
-            # Validate date format
-            try:
-                datetime.datetime.strptime(date, "%Y-%m-%d")
-            except ValueError:
-                return {"success": False, "error": "Date must be in YYYY-MM-DD format"}
+            if not date:
+                # Already canonical; no need to validate it
+                date = _today()
+            else:
+                # Validate date format and store it zero-padded so date
+                # ordering and ym stay correct
+                try:
+                    date = _parse_date(date)
+                except ValueError:
+                    return {
+                        "success": False,
+                        "error": "Date must be in YYYY-MM-DD format",
+                    }
 
             # Add transaction to database
             self.db.add_transaction(
                 user_id=user_id,
-                amount=amount,
+                amount_cents=amount_cents,
                 category=category,
                 date=date,
                 transaction_type="expense",
             )
-
-            self.logger.info(
-                f"Logged expense: {amount} in {category} for user {user_id}"
-            )
             return {
                 "success": True,
-                "message": f"Expense of ${amount:.2f} for {category} on {date} has been logged.",
+                "message": f"Expense of ${amount_cents / 100:.2f} for {category} on {date} has been logged.",
             }
         except Exception as e:
             self.logger.error(f"Error logging expense: {str(e)}")
             return {"success": False, "error": str(e)}
 
+    @_require_user_id
     def log_income(
         self, amount: float, source: str, date: str = None, user_id: int = None
     ) -> dict:
@@ -94,49 +170,118 @@ class FinancialFunctions:
             dict: Result of the operation
         """
         try:
-            if not user_id:
-                return {
-                    "success": False,
-                    "error": "User ID is required for transactions",
-                }
-
-            if not date:
-                date = datetime.datetime.now().strftime("%Y-%m-%d")
-
-            # Validate amount
-            if not isinstance(amount, (int, float)) or amount <= 0:
+            # Validate amount; stored as integer cents so sums stay exact
+            amount_cents = _to_cents(amount)
+            if amount_cents <= 0:
                 return {"success": False, "error": "Amount must be a positive number"}
 
             # Validate source
             if not source or not isinstance(source, str):
                 return {"success": False, "error": "Source must be a non-empty string"}
 
-            # Validate date format
-            try:
-                datetime.datetime.strptime(date, "%Y-%m-%d")
-            except ValueError:
-                return {"success": False, "error": "Date must be in YYYY-MM-DD format"}
+            if not date:
+                # Already canonical; no need to validate it
+                date = _today()
+            else:
+                # Validate date format and store it zero-padded so date
+                # ordering and ym stay correct
+                try:
+                    date = _parse_date(date)
+                except ValueError:
+                    return {
+                        "success": False,
+                        "error": "Date must be in YYYY-MM-DD format",
+                    }
 
             # Add transaction to database
             self.db.add_transaction(
                 user_id=user_id,
-                amount=amount,
+                amount_cents=amount_cents,
                 category=source,
                 date=date,
                 transaction_type="income",
             )
-
-            self.logger.info(
-                f"Logged income: {amount} from {source} for user {user_id}"
-            )
             return {
                 "success": True,
-                "message": f"Income of ${amount:.2f} from {source} on {date} has been logged.",
+                "message": f"Income of ${amount_cents / 100:.2f} from {source} on {date} has been logged.",
             }
         except Exception as e:
             self.logger.error(f"Error logging income: {str(e)}")
             return {"success": False, "error": str(e)}
 
+    @_require_user_id
+    def log_transactions_bulk(self, transactions: list, user_id: int = None) -> dict:
+        """
+        Log several expense and income transactions at once.
+
+        Args:
+            transactions (list): Dicts with type ('expense' or 'income'), amount,
+                category and an optional date in YYYY-MM-DD format
+            user_id (int, optional): The ID of the user making the transactions
+
+        Returns:
+            dict: Result of the operation
+        """
+        try:
+            if not transactions or not isinstance(transactions, list):
+                return {
+                    "success": False,
+                    "error": "Transactions must be a non-empty list",
+                }
+
+            today = _today()
+            rows = []
+            total = {"expense": 0, "income": 0}
+            for number, transaction in enumerate(transactions, start=1):
+                transaction_type = transaction.get("type")
+                amount = transaction.get("amount")
+                category = transaction.get("category")
+                date = transaction.get("date")
+
+                # Validate each row the same way log_expense/log_income do
+                if transaction_type not in total:
+                    return {
+                        "success": False,
+                        "error": f"Transaction {number}: type must be 'expense' or 'income'",
+                    }
+                amount_cents = _to_cents(amount)
+                if amount_cents <= 0:
+                    return {
+                        "success": False,
+                        "error": f"Transaction {number}: amount must be a positive number",
+                    }
+                if not category or not isinstance(category, str):
+                    return {
+                        "success": False,
+                        "error": f"Transaction {number}: category must be a non-empty string",
+                    }
+                if not date:
+                    date = today
+                else:
+                    try:
+                        date = _parse_date(date)
+                    except ValueError:
+                        return {
+                            "success": False,
+                            "error": f"Transaction {number}: date must be in YYYY-MM-DD format",
+                        }
+
+                rows.append((user_id, amount_cents, category, date, transaction_type))
+                total[transaction_type] += amount_cents
+
+            # One database transaction for the whole batch
+            self.db.add_transactions_bulk(rows)
+
+            return {
+                "success": True,
+                "message": f"{len(rows)} transactions have been logged "
+                f"(expenses ${total['expense'] / 100:.2f}, income ${total['income'] / 100:.2f}).",
+            }
+        except Exception as e:
+            self.logger.error(f"Error logging transactions: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    @_require_user_id
     def get_monthly_summary(
         self, month: int = None, year: int = None, user_id: int = None
     ) -> dict:
@@ -152,12 +297,6 @@ class FinancialFunctions:
             dict: Summary of transactions
         """
         try:
-            if not user_id:
-                return {
-                    "success": False,
-                    "error": "User ID is required for transactions",
-                }
-
             # Use current month/year if not specified
             if not month or not year:
                 now = datetime.datetime.now()
@@ -173,43 +312,29 @@ class FinancialFunctions:
             if not isinstance(year, int) or year < 1900 or year > 2100:
                 return {"success": False, "error": "Year must be a valid year"}
 
-            # Calculate start and end dates for the month
-            start_date = f"{year}-{month:02d}-01"
-            if month == 12:
-                end_date = f"{year + 1}-01-01"
-            else:
-                end_date = f"{year}-{month + 1:02d}-01"
-
-            # Get transactions from database
-            transactions = self.db.get_transactions(
-                user_id=user_id, start_date=start_date, end_date=end_date
+            # Aggregate in SQL rather than pulling every row into Python
+            summary = self.db.get_monthly_summary(
+                user_id=user_id, year=year, month=month
             )
 
-            # Calculate summary
-            total_income = sum(
-                t["amount"] for t in transactions if t["transaction_type"] == "income"
-            )
-            total_expenses = sum(
-                t["amount"] for t in transactions if t["transaction_type"] == "expense"
-            )
-            balance = total_income - total_expenses
-
             self.logger.info(
                 f"Retrieved monthly summary for user {user_id}: {year}-{month:02d}"
             )
             return {
                 "success": True,
+                # The database sums exact cents; present them as currency units
                 "summary": {
-                    "income": total_income,
-                    "expenses": total_expenses,
-                    "balance": balance,
-                    "transactions": len(transactions),
+                    "income": summary["income"] / 100,
+                    "expenses": summary["expenses"] / 100,
+                    "balance": summary["balance"] / 100,
+                    "transactions": summary["transactions"],
                 },
             }
         except Exception as e:
             self.logger.error(f"Error getting monthly summary: {str(e)}")
             return {"success": False, "error": str(e)}
 
+    @_require_user_id
     def get_exchange_rate(
         self, from_currency: str, to_currency: str, user_id: int = None
     ) -> dict:
@@ -225,21 +350,33 @@ class FinancialFunctions:
             dict: Exchange rate information
         """
         try:
-            if not user_id:
-                return {
-                    "success": False,
-                    "error": "User ID is required for transactions",
-                }
-
             # Validate currency codes
             if not from_currency or not to_currency:
                 return {"success": False, "error": "Both currency codes are required"}
 
-            # Get exchange rate from API
-            rate = self.exchange_api.get_exchange_rate(from_currency, to_currency)
+            # Normalize once so " usd" and "USD" share a cache entry upstream
+            from_currency = from_currency.strip().upper()
+            to_currency = to_currency.strip().upper()
+            if not (
+                _CURRENCY_RE.fullmatch(from_currency)
+                and _CURRENCY_RE.fullmatch(to_currency)
+            ):
+                return {
+                    "success": False,
+                    "error": "Currency codes must be 3-letter ISO 4217 codes",
+                }
 
-            if not rate:
-                return {"success": False, "error": "Failed to get exchange rate"}
+            if from_currency == to_currency:
+                rate = {"rate": 1.0, "date": _today()}
+            else:
+                # Get exchange rate from API
+                rate = self.exchange_api.get_exchange_rate(from_currency, to_currency)
+
+                if not rate or not rate.get("success"):
+                    return {
+                        "success": False,
+                        "error": (rate or {}).get("error", "Failed to get exchange rate"),
+                    }
 
             self.logger.info(
                 f"Retrieved exchange rate: {from_currency} to {to_currency} for user {user_id}"
@@ -251,6 +388,7 @@ class FinancialFunctions:
                     "to": to_currency,
                     "rate": rate["rate"],
                     "date": rate["date"],
+                    "stale": rate.get("stale", False),
                 },
             }
         except Exception as e:
@@ -258,13 +396,17 @@ class FinancialFunctions:
             return {"success": False, "error": str(e)}
 
 
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=FinancialFunctions._reset_after_fork)
+
+
 if __name__ == "__main__":
-    financial_functions = FinancialFunctions()
+    financial_functions = FinancialFunctions.instance()
     # Test log_expense function
     expense_result = financial_functions.log_expense(amount=100, category="Food")
     print(expense_result)
     # Test log_income function
-    income_result = financial_functions.log_income(amount=500, category="Salary")
+    income_result = financial_functions.log_income(amount=500, source="Salary")
     print(income_result)
     # Test get_monthly_summary function
     summary_result = financial_functions.get_monthly_summary(year=2024, month=1)
@@ -2,12 +2,17 @@ import os
 from google import genai
 from google.genai import types
 from functions import FinancialFunctions
-import json
+import orjson
 from dotenv import load_dotenv
 import datetime
 import logging
 import sys
+import hashlib
+import queue
+import threading
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 
 # Configure logging
 logging.basicConfig(
@@ -24,121 +29,305 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 
-class GeminiAgent:
-    def __init__(self):
-        self.chat_history = deque(maxlen=5)
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is not set")
+def _text_content(role: str, text: str) -> types.Content:
+    """Wrap a message as the types.Content the model expects"""
+    return types.Content(role=role, parts=[types.Part.from_text(text=text)])
 
-        self.client = genai.Client(api_key=self.api_key)
-        self.model = "gemini-2.0-flash"
-        self.functions = FinancialFunctions()
-        self.chat_history = deque(maxlen=5)  # Store last 5 messages
-        logger.info(f"Initialized GeminiAgent with model: {self.model}")
 
-        # Define function declarations for Gemini
-        self.log_expense_func = types.FunctionDeclaration(
-            name="log_expense",
-            description="Log or record an expense (money spent) with a specified amount and category (e.g., 'food', 'transport', 'rent'), optionally including the date (defaults to today).",
-            parameters={
-                "type": "OBJECT",
-                "properties": {
-                    "amount": {
-                        "type": "number",
-                        "description": "The amount of the expense.",
-                    },
-                    "category": {
-                        "type": "string",
-                        "description": "Category of the expense (e.g., food, transport, utilities).",
-                    },
-                    "date": {
-                        "type": "string",
-                        "description": "Date of the expense in YYYY-MM-DD format (optional; defaults to today).",
-                    },
-                },
-                "required": ["amount", "category"],
+def _coerce_args(args) -> dict:
+    """Normalize function-call args (dict, mapping or JSON string) to a plain dict"""
+    if isinstance(args, dict):
+        return args
+    if isinstance(args, str):
+        try:
+            parsed = orjson.loads(args) if args.strip() else {}
+        except orjson.JSONDecodeError:
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+    try:
+        return dict(args.items())
+    except AttributeError:
+        return {}
+
+
+# Shown whenever a turn fails; details go to the log only
+_ERROR_REPLY = (
+    "I apologize, but I encountered an error processing your message. "
+    "Please try again."
+)
+
+_FMT_LOGGED = "Successfully logged the transaction. {message}"
+_FMT_SUMMARY = "Here's your monthly summary:\nIncome: ${income:.2f}\nExpenses: ${expenses:.2f}\nBalance: ${balance:.2f}\nTotal transactions: {transactions}"
+_FMT_RATE = "The exchange rate from {from} to {to} on {date} is {rate:.4f}"
+_FMT_STALE_RATE = " (last known rate; live rates are unavailable right now)"
+
+
+def _format_logged(result):
+    return _FMT_LOGGED.format_map(result)
+
+
+def _format_summary(result):
+    return _FMT_SUMMARY.format_map(result["summary"])
+
+
+def _format_exchange_rate(result):
+    text = _FMT_RATE.format_map(result["rate"])
+    if result["rate"].get("stale"):
+        text += _FMT_STALE_RATE
+    return text
+
+
+# Turns a successful function result into the assistant's reply
+_FORMATTERS = {
+    "log_expense": _format_logged,
+    "log_income": _format_logged,
+    "log_transactions_bulk": _format_logged,
+    "get_monthly_summary": _format_summary,
+    "get_exchange_rate": _format_exchange_rate,
+}
+
+# Tool names the agent accepts; a call is only valid if it can also be formatted
+_FUNCTION_NAMES = frozenset(_FORMATTERS)
+
+
+# Function declarations for Gemini, shared by every agent instance
+_LOG_EXPENSE_FUNC = types.FunctionDeclaration(
+    name="log_expense",
+    description="Log or record an expense (money spent) with a specified amount and category (e.g., 'food', 'transport', 'rent'), optionally including the date (defaults to today).",
+    parameters={
+        "type": "OBJECT",
+        "properties": {
+            "amount": {
+                "type": "number",
+                "description": "The amount of the expense.",
             },
-        )
+            "category": {
+                "type": "string",
+                "description": "Category of the expense (e.g., food, transport, utilities).",
+            },
+            "date": {
+                "type": "string",
+                "description": "Date of the expense in YYYY-MM-DD format (optional; defaults to today).",
+            },
+        },
+        "required": ["amount", "category"],
+    },
+)
 
-        self.log_income_func = types.FunctionDeclaration(
-            name="log_income",
-            description="Log or record an income (earning) with a specified amount and source (e.g., 'salary', 'freelancing', 'investment'), optionally including the date (defaults to today).",
-            parameters={
-                "type": "OBJECT",
-                "properties": {
-                    "amount": {
-                        "type": "number",
-                        "description": "The amount of the income.",
-                    },
-                    "source": {
-                        "type": "string",
-                        "description": "Source of the income (e.g., salary, freelancing, investment).",
-                    },
-                    "date": {
-                        "type": "string",
-                        "description": "Date of the income in YYYY-MM-DD format (optional; defaults to today).",
-                    },
-                },
-                "required": ["amount", "source"],
+_LOG_INCOME_FUNC = types.FunctionDeclaration(
+    name="log_income",
+    description="Log or record an income (earning) with a specified amount and source (e.g., 'salary', 'freelancing', 'investment'), optionally including the date (defaults to today).",
+    parameters={
+        "type": "OBJECT",
+        "properties": {
+            "amount": {
+                "type": "number",
+                "description": "The amount of the income.",
             },
-        )
+            "source": {
+                "type": "string",
+                "description": "Source of the income (e.g., salary, freelancing, investment).",
+            },
+            "date": {
+                "type": "string",
+                "description": "Date of the income in YYYY-MM-DD format (optional; defaults to today).",
+            },
+        },
+        "required": ["amount", "source"],
+    },
+)
 
-        self.get_monthly_summary_func = types.FunctionDeclaration(
-            name="get_monthly_summary",
-            description="Retrieve a summary of expenses and income for a specific month and year, including total spending, total earnings, and net balance. Useful for viewing a monthly financial report.",
-            parameters={
-                "type": "OBJECT",
-                "properties": {
-                    "month": {
-                        "type": "integer",
-                        "description": "Month number (1-12) for the summary. the default is this month ",
-                    },
-                    "year": {
-                        "type": "integer",
-                        "description": "Year (e.g., 2024) for the summary.the default is this year",
+_LOG_TRANSACTIONS_BULK_FUNC = types.FunctionDeclaration(
+    name="log_transactions_bulk",
+    description="Log several expenses and/or incomes at once, e.g. every item on a receipt or every line of a statement. Prefer this over repeated log_expense/log_income calls when the user lists more than one transaction.",
+    parameters={
+        "type": "OBJECT",
+        "properties": {
+            "transactions": {
+                "type": "ARRAY",
+                "description": "The transactions to log.",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "type": {
+                            "type": "string",
+                            "enum": ["expense", "income"],
+                            "description": "Whether this is an expense or an income.",
+                        },
+                        "amount": {
+                            "type": "number",
+                            "description": "The amount of the transaction.",
+                        },
+                        "category": {
+                            "type": "string",
+                            "description": "Expense category or income source (e.g., food, salary).",
+                        },
+                        "date": {
+                            "type": "string",
+                            "description": "Date in YYYY-MM-DD format (optional; defaults to today).",
+                        },
                     },
+                    "required": ["type", "amount", "category"],
                 },
             },
-        )
+        },
+        "required": ["transactions"],
+    },
+)
 
-        self.get_exchange_rate_func = types.FunctionDeclaration(
-            name="get_exchange_rate",
-            description="Retrieve the exchange (conversion) rate from one currency to another for a given date. Provide source and target currency codes (e.g., USD, ETB) and an optional date (defaults to today).",
-            parameters={
-                "type": "OBJECT",
-                "properties": {
-                    "from_currency": {
-                        "type": "string",
-                        "description": "Source currency code (e.g., USD).",
-                    },
-                    "to_currency": {
-                        "type": "string",
-                        "description": "Target currency code (e.g., ETB).",
-                    },
-                },
-                "required": ["from_currency", "to_currency"],
+_GET_MONTHLY_SUMMARY_FUNC = types.FunctionDeclaration(
+    name="get_monthly_summary",
+    description="Retrieve a summary of expenses and income for a specific month and year, including total spending, total earnings, and net balance. Useful for viewing a monthly financial report.",
+    parameters={
+        "type": "OBJECT",
+        "properties": {
+            "month": {
+                "type": "integer",
+                "description": "Month number (1-12) for the summary. the default is this month ",
+            },
+            "year": {
+                "type": "integer",
+                "description": "Year (e.g., 2024) for the summary.the default is this year",
             },
+        },
+    },
+)
+
+_GET_EXCHANGE_RATE_FUNC = types.FunctionDeclaration(
+    name="get_exchange_rate",
+    description="Retrieve the exchange (conversion) rate from one currency to another for a given date. Provide source and target currency codes (e.g., USD, ETB) and an optional date (defaults to today).",
+    parameters={
+        "type": "OBJECT",
+        "properties": {
+            "from_currency": {
+                "type": "string",
+                "description": "Source currency code (e.g., USD).",
+            },
+            "to_currency": {
+                "type": "string",
+                "description": "Target currency code (e.g., ETB).",
+            },
+        },
+        "required": ["from_currency", "to_currency"],
+    },
+)
+
+# Messages of context kept per user; deque(maxlen=) evicts the oldest in O(1)
+_HISTORY_LENGTH = 5
+
+# Threads for overlapping read-only function calls, independent of the
+# Gemini budget since tool calls don't count against the API limit
+_TOOL_WORKERS = 8
+
+# Queued by _drain_stream after a streamed response's last chunk
+_STREAM_END = object()
+
+# Tool calls that write; a response containing any of them runs its calls
+# in model-emitted order instead of concurrently
+_WRITE_FUNCTIONS = frozenset({"log_expense", "log_income", "log_transactions_bulk"})
+
+_TOOLS = types.Tool(
+    function_declarations=[
+        _LOG_EXPENSE_FUNC,
+        _LOG_INCOME_FUNC,
+        _LOG_TRANSACTIONS_BULK_FUNC,
+        _GET_MONTHLY_SUMMARY_FUNC,
+        _GET_EXCHANGE_RATE_FUNC,
+    ]
+)
+
+
+class GeminiAgent:
+    def __init__(self):
+        self.api_key = os.getenv("GEMINI_API_KEY")
+        if not self.api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is not set")
+
+        self.client = genai.Client(api_key=self.api_key)
+        self.model = "gemini-2.0-flash"
+        # Shared across agents so DB and HTTP state are built once per process
+        self.functions = FinancialFunctions.instance()
+        # Function name -> bound method, looked up once per tool call
+        self._dispatch = {
+            "log_expense": self.functions.log_expense,
+            "log_income": self.functions.log_income,
+            "log_transactions_bulk": self.functions.log_transactions_bulk,
+            "get_monthly_summary": self.functions.get_monthly_summary,
+            "get_exchange_rate": self.functions.get_exchange_rate,
+        }
+        # Recent messages per user, so concurrent turns never mix one
+        # user's context into another's
+        self._histories = TTLCache(maxsize=10_000, ttl=3600)
+        self._histories_lock = threading.Lock()
+
+        # One budget for every Gemini call this process makes, so bursts
+        # queue here instead of coming back as 429s. Under gunicorn it is
+        # this worker's share of the tier limit (see gunicorn.conf.py); a
+        # single-process server gets the whole GEMINI_CONCURRENCY.
+        concurrency = int(
+            os.getenv("GEMINI_WORKER_CONCURRENCY")
+            or os.getenv("GEMINI_CONCURRENCY", "15")
+        )
+        self._gemini_slots = threading.BoundedSemaphore(concurrency)
+        # Overlapping read-only function calls (SQLite, FastForex) run here
+        self._tool_pool = ThreadPoolExecutor(
+            max_workers=_TOOL_WORKERS, thread_name_prefix="agent-tools"
         )
+        logger.info(f"Initialized GeminiAgent with model: {self.model}")
 
-        self.tools = types.Tool(
-            function_declarations=[
-                self.log_expense_func,
-                self.log_income_func,
-                self.get_monthly_summary_func,
-                self.get_exchange_rate_func,
-            ]
+        # Exact-match cache of plain-text answers (never tool-call results)
+        self._response_cache = TTLCache(maxsize=10_000, ttl=3600)
+        self._response_cache_lock = threading.Lock()
+
+        self.tools = _TOOLS
+        # Built and validated once; every request reuses the same config
+        self._gen_config = types.GenerateContentConfig(
+            tools=[self.tools],
+            temperature=0.7,
+            top_p=0.8,
+            top_k=40,
+            max_output_tokens=2048,
         )
         logger.info("Function declarations and tools configured")
 
-    def _format_chat_history(self):
+    def _chat_history(self, user_id: int) -> deque:
+        """Return the user's recent messages, starting an empty history if needed"""
+        with self._histories_lock:
+            history = self._histories.get(user_id)
+            if history is None:
+                history = self._histories[user_id] = deque(maxlen=_HISTORY_LENGTH)
+            return history
+
+    def _format_chat_history(self, history: deque):
         """Format chat history for the model context"""
-        formatted_history = []
-        for message in self.chat_history:
-            formatted_history.append(
-                {"role": message["role"], "parts": [{"text": message["content"]}]}
-            )
-        return formatted_history
+        # Entries are stored as types.Content, so there is nothing to convert
+        return list(history)
+
+    def response_cache_key(self, message: str, user_id: int) -> str:
+        """
+        Build the response cache key (also used as the HTTP ETag)
+
+        The key covers the user's current history, so an answer is only
+        replayed in the same conversation context it was first given in.
+        """
+        history = [
+            (content.role, content.parts[0].text)
+            for content in list(self._chat_history(user_id))
+        ]
+        raw = orjson.dumps([self.model, message.strip().lower(), user_id, history])
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    def get_cached_response(self, cache_key: str) -> dict:
+        """Return the cached response for a key, or None"""
+        with self._response_cache_lock:
+            return self._response_cache.get(cache_key)
+
+    def _replay_turn(self, message: str, user_id: int, cached: dict) -> dict:
+        """Record a cached answer in the user's history, as a live turn would be"""
+        history = self._chat_history(user_id)
+        history.append(_text_content("user", message))
+        history.append(_text_content("model", cached["response"]))
+        return cached
 
     def process_message(self, message: str, user_id: int = None) -> dict:
         """
@@ -155,124 +344,287 @@ class GeminiAgent:
             if not user_id:
                 return {"response": "Please log in to use this feature."}
 
-            # Add user message to chat history
-            self.chat_history.append({"role": "user", "content": message})
+            cache_key = self.response_cache_key(message, user_id)
+            cached = self.get_cached_response(cache_key)
+            if cached is not None:
+                return self._replay_turn(message, user_id, cached)
 
-            # Get formatted chat history
-            contents = self._format_chat_history()
+            # Generate response using the model
+            request = self._begin_turn(message, user_id)
+            with self._gemini_slots:
+                response = self.client.models.generate_content(**request)
+            return self._finish_turn(response, user_id, cache_key)
+        except Exception as e:
+            # Traceback goes to the log only; the reply stays short and generic
+            logger.exception(f"Error processing message: {str(e)}")
+            return {"response": _ERROR_REPLY}
 
-            # Add user context to the message if user_id is provided
-            context_message = f"[User ID: {user_id}] {message}"
+    def stream_message(self, message: str, user_id: int = None):
+        """
+        Process a user message, yielding the reply as the model generates it
 
-            # Generate response using the model
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=contents
-                + [{"role": "user", "parts": [{"text": context_message}]}],
-                config=types.GenerateContentConfig(
-                    tools=[self.tools],
-                    temperature=0.7,
-                    top_p=0.8,
-                    top_k=40,
-                    max_output_tokens=2048,
-                ),
-            )
+        Plain answers stream chunk by chunk. Once the model asks for a
+        function call the rest of the response is buffered, and the formatted
+        function result is yielded as one final piece.
 
-            if not hasattr(response, "candidates") or not response.candidates:
-                logger.warning("Empty response received from model")
-                return {
-                    "response": "I received an empty response from the model. Please try again."
-                }
+        Args:
+            message (str): The user's message
+            user_id (int, optional): The ID of the user sending the message
 
-            candidate = response.candidates[0]
-            if not hasattr(candidate, "content") or not candidate.content:
-                logger.warning("No content in candidate response")
-                return {
-                    "response": "I couldn't process the model's response. Please try again."
-                }
+        Yields:
+            str: Successive pieces of the assistant's message
+        """
+        try:
+            if not user_id:
+                yield "Please log in to use this feature."
+                return
+
+            cache_key = self.response_cache_key(message, user_id)
+            cached = self.get_cached_response(cache_key)
+            if cached is not None:
+                yield self._replay_turn(message, user_id, cached)["response"]
+                return
+
+            request = self._begin_turn(message, user_id)
+            # A helper thread pulls the response off Gemini as fast as it
+            # arrives, so the Gemini slot is freed when the model is done
+            # rather than when a slow client has read everything
+            chunks = queue.SimpleQueue()
+            threading.Thread(
+                target=self._drain_stream, args=(request, chunks), daemon=True
+            ).start()
+            parts = []
+            while (chunk := chunks.get()) is not _STREAM_END:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                text = self._take_chunk(chunk, parts)
+                if text:
+                    yield text
+            reply, calls = self._end_stream(parts, user_id, cache_key)
+            if calls:
+                results = self._execute_calls(calls)
+                reply = self._build_reply(parts, calls, results, user_id, cache_key)
+                reply = reply["response"]
+            if reply:
+                yield reply
+        except Exception as e:
+            # Traceback goes to the log only; the reply stays short and generic
+            logger.exception(f"Error streaming message: {str(e)}")
+            yield _ERROR_REPLY
+
+    def _drain_stream(self, request: dict, chunks: queue.SimpleQueue):
+        """Queue a streamed response's chunks, holding a Gemini slot only meanwhile"""
+        try:
+            with self._gemini_slots:
+                for chunk in self.client.models.generate_content_stream(**request):
+                    chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(_STREAM_END)
+
+    def _begin_turn(self, message: str, user_id: int) -> dict:
+        """Record the user message and build the generate_content arguments"""
+        # Add user message to chat history
+        history = self._chat_history(user_id)
+        history.append(_text_content("user", message))
+
+        # Get formatted chat history
+        contents = self._format_chat_history(history)
+
+        # Add user context to the message if user_id is provided
+        context_message = f"[User ID: {user_id}] {message}"
+
+        return {
+            "model": self.model,
+            "contents": contents + [_text_content("user", context_message)],
+            "config": self._gen_config,
+        }
+
+    def _finish_turn(self, response, user_id: int, cache_key: str) -> dict:
+        """Run any function calls in the model response and build the reply"""
+        parts, calls, reply = self._plan_turn(response, user_id)
+        if reply is not None:
+            return reply
+        results = self._execute_calls(calls)
+        return self._build_reply(parts, calls, results, user_id, cache_key)
+
+    def _plan_turn(self, response, user_id: int):
+        """
+        Unpack the model response and prepare its function calls
 
-            content = candidate.content
-            if not hasattr(content, "parts") or not content.parts:
-                logger.warning("No parts in content response")
-                return {
-                    "response": "The response format was unexpected. Please try again."
+        Returns:
+            tuple: (parts, calls, reply) where calls holds (name, function, args)
+                per function-call part; reply is set instead when the response
+                can't be acted on
+        """
+        candidates = getattr(response, "candidates", None)
+        if not candidates:
+            logger.warning("Empty response received from model")
+            return None, None, {
+                "response": "I received an empty response from the model. Please try again."
+            }
+
+        content = getattr(candidates[0], "content", None)
+        if not content:
+            logger.warning("No content in candidate response")
+            return None, None, {
+                "response": "I couldn't process the model's response. Please try again."
+            }
+
+        parts = getattr(content, "parts", None)
+        if not parts:
+            logger.warning("No parts in content response")
+            return None, None, {
+                "response": "The response format was unexpected. Please try again."
+            }
+
+        calls, reply = self._prepare_calls(parts, user_id)
+        return parts, calls, reply
+
+    def _prepare_calls(self, parts, user_id: int):
+        """
+        Resolve the function-call parts of a response
+
+        Returns:
+            tuple: (calls, reply) where calls holds (name, function, args) per
+                function-call part; reply is set instead for an unknown function
+        """
+        calls = []
+        for part in parts:
+            function_call = getattr(part, "function_call", None)
+            if function_call is None:
+                continue
+            function_name = function_call.name
+            args = function_call.args
+
+            # One lazily formatted record; args can be a long bulk list
+            logger.info("Function call: %s args=%s", function_name, args)
+
+            # Reject unknown names before doing any work on their args, and
+            # before running any of the response's calls
+            if function_name not in _FUNCTION_NAMES:
+                logger.warning(f"Unknown function called: {function_name}")
+                return None, {
+                    "response": "I'm sorry, I don't know how to handle that function."
                 }
 
-            response_text = ""
-            for part in content.parts:
-                if hasattr(part, "function_call") and part.function_call is not None:
-                    function_call = part.function_call
-                    function_name = function_call.name
-                    args = function_call.args
-
-                    logger.info(f"Function name: {function_name}")
-                    logger.info(f"Function args: {args}")
-
-                    if not isinstance(args, dict):
-                        try:
-                            args = dict(args)
-                        except Exception:
-                            if isinstance(args, str) and args.strip():
-                                try:
-                                    args = json.loads(args)
-                                except Exception:
-                                    args = {}
-                            else:
-                                args = {}
-
-                    # Add user_id to args
-                    args["user_id"] = user_id
-
-                    # If get_monthly_summary and year/month missing, use current year/month
-                    if function_name == "get_monthly_summary":
-                        now = datetime.datetime.now()
-                        if "year" not in args or not args["year"]:
-                            args["year"] = now.year
-                        if "month" not in args or not args["month"]:
-                            args["month"] = now.month
-
-                    # Call the appropriate function
-                    if function_name == "log_expense":
-                        result = self.functions.log_expense(**args)
-                    elif function_name == "log_income":
-                        result = self.functions.log_income(**args)
-                    elif function_name == "get_monthly_summary":
-                        result = self.functions.get_monthly_summary(**args)
-                    elif function_name == "get_exchange_rate":
-                        result = self.functions.get_exchange_rate(**args)
-                    else:
-                        logger.warning(f"Unknown function called: {function_name}")
-                        return {
-                            "response": "I'm sorry, I don't know how to handle that function."
-                        }
-
-                    # Generate a natural language response based on the function result
-                    if result.get("success"):
-                        if function_name in ["log_expense", "log_income"]:
-                            response_text = f"Successfully logged the transaction. {result['message']}"
-                        elif function_name == "get_monthly_summary":
-                            summary = result["summary"]
-                            response_text = f"Here's your monthly summary:\nIncome: ${summary['income']:.2f}\nExpenses: ${summary['expenses']:.2f}\nBalance: ${summary['balance']:.2f}\nTotal transactions: {summary['transactions']}"
-                        elif function_name == "get_exchange_rate":
-                            rate = result["rate"]
-                            response_text = f"The exchange rate from {rate['from']} to {rate['to']} on {rate['date']} is {rate['rate']:.4f}"
-                        logger.info(f"Function {function_name} executed successfully")
-                    else:
-                        error_msg = f"I encountered an error: {result.get('error', 'Unknown error')}"
-                        logger.error(f"Function {function_name} failed: {error_msg}")
-                        return {"response": error_msg}
+            # Copy so adding user_id never mutates the SDK's object
+            args = dict(_coerce_args(args))
+
+            # Add user_id to args
+            args["user_id"] = user_id
+
+            # If get_monthly_summary and year/month missing, use current year/month
+            if function_name == "get_monthly_summary":
+                now = datetime.datetime.now()
+                if "year" not in args or not args["year"]:
+                    args["year"] = now.year
+                if "month" not in args or not args["month"]:
+                    args["month"] = now.month
+
+            calls.append((function_name, self._dispatch[function_name], args))
+
+        return calls, None
+
+    @staticmethod
+    def _run_calls(calls: list) -> list:
+        """Run prepared function calls one after another, in model order"""
+        return [function(**args) for _, function, args in calls]
+
+    @staticmethod
+    def _can_overlap(calls: list) -> bool:
+        """Whether calls may run concurrently: several of them and none writes"""
+        # A later call may depend on an earlier write, so writes keep model order
+        return len(calls) > 1 and not any(
+            name in _WRITE_FUNCTIONS for name, _, _ in calls
+        )
+
+    def _execute_calls(self, calls: list) -> list:
+        """Run prepared function calls, overlapping them when they are all reads"""
+        if not self._can_overlap(calls):
+            return self._run_calls(calls)
+        futures = [
+            self._tool_pool.submit(function, **args) for _, function, args in calls
+        ]
+        return [future.result() for future in futures]
+
+    def _build_reply(
+        self, parts, calls: list, results: list, user_id: int, cache_key: str
+    ) -> dict:
+        """Turn the response parts and function results into the assistant reply"""
+        response_text = ""
+        outcomes = iter(zip(calls, results))
+        for part in parts:
+            if getattr(part, "function_call", None) is not None:
+                (function_name, _, _), result = next(outcomes)
+
+                # Generate a natural language response based on the function result
+                if result.get("success"):
+                    response_text = _FORMATTERS[function_name](result)
+                    logger.info(f"Function {function_name} executed successfully")
                 else:
-                    response_text = part.text
+                    error_msg = f"I encountered an error: {result.get('error', 'Unknown error')}"
+                    logger.error(f"Function {function_name} failed: {error_msg}")
+                    return {"response": error_msg}
+            else:
+                response_text = part.text
+
+        return self._record_reply(
+            response_text, user_id, cache_key, cacheable=not calls
+        )
 
-            # Add assistant response to chat history
-            self.chat_history.append({"role": "assistant", "content": response_text})
+    def _record_reply(
+        self, response_text: str, user_id: int, cache_key: str, cacheable: bool
+    ) -> dict:
+        """Add the reply to the user's history and cache it if it's replayable"""
+        # Add assistant response to chat history
+        self._chat_history(user_id).append(_text_content("model", response_text))
+
+        result = {"response": response_text}
+        # Tool calls have side effects or time-dependent data; only
+        # plain answers are safe to replay
+        if cacheable and response_text:
+            with self._response_cache_lock:
+                self._response_cache[cache_key] = result
+        return result
+
+    def _take_chunk(self, chunk, parts: list) -> str:
+        """Collect a streamed chunk's parts; return its text until a call appears"""
+        candidates = getattr(chunk, "candidates", None)
+        content = getattr(candidates[0], "content", None) if candidates else None
+        chunk_parts = getattr(content, "parts", None) or []
+        parts.extend(chunk_parts)
+        if any(getattr(part, "function_call", None) is not None for part in parts):
+            return ""
+        return "".join(getattr(part, "text", None) or "" for part in chunk_parts)
+
+    def _end_stream(self, parts: list, user_id: int, cache_key: str):
+        """
+        Wrap up a streamed turn once the model is done
 
-            return {"response": response_text}
-        except Exception as e:
-            logger.error(f"Error processing message: {str(e)}")
-            return {
-                "response": "I apologize, but I encountered an error processing your message. Please try again."
-            }
+        Returns:
+            tuple: (reply, calls) where reply is text still to send (None when
+                everything was streamed) and calls are prepared function calls
+                the caller runs and passes to _build_reply
+        """
+        if not parts:
+            logger.warning("Empty response received from model")
+            return (
+                "I received an empty response from the model. Please try again.",
+                None,
+            )
+
+        if not any(getattr(part, "function_call", None) is not None for part in parts):
+            # Everything was already streamed; just record the full text
+            response_text = "".join(getattr(part, "text", None) or "" for part in parts)
+            self._record_reply(response_text, user_id, cache_key, cacheable=True)
+            return None, None
+
+        calls, reply = self._prepare_calls(parts, user_id)
+        if reply is not None:
+            return reply["response"], None
+        return None, calls
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+"""
+Gunicorn configuration for the financial assistant application.
+
+Run with: gunicorn app:app
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Chat requests spend most of their time waiting on Gemini, FastForex and
+# SQLite, so each worker runs a thread pool to overlap that I/O.
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+# GEMINI_CONCURRENCY is the API tier's limit on concurrent calls across the
+# whole deployment. Each worker gets an equal share of it (at least one),
+# capped at its thread count since a worker never has more calls in flight
+# than threads. Set GEMINI_WORKER_CONCURRENCY to override the share.
+os.environ.setdefault(
+    "GEMINI_WORKER_CONCURRENCY",
+    str(max(1, min(threads, int(os.getenv("GEMINI_CONCURRENCY", 15)) // workers))),
+)
+
+# Gemini calls can take several seconds
+timeout = 60
+keepalive = 5
+
+
+def post_worker_init(worker):
+    """Build the database pool and agent in each worker before it takes traffic"""
+    # An exception here is a worker boot error, which halts the whole server;
+    # on failure the worker boots anyway and builds them on first request
+    try:
+        from app import get_agent, get_db
+
+        get_db()
+        get_agent().functions.exchange_api.start_refresher()
+    except Exception:
+        worker.log.exception("Worker warm-up failed; initializing on first request")
@@ -1,7 +1,9 @@
-import json
-from datetime import datetime
+import orjson
+from datetime import datetime, timezone
 from enum import Enum
 import os
+import threading
+from dates import parse_ymd
 
 
 class TransactionType(Enum):
@@ -9,56 +11,93 @@ class TransactionType(Enum):
     EXPENSE = "expense"
 
 
+# Looked up once rather than through the enum for every transaction
+_INCOME = TransactionType.INCOME.value
+
+
 class FileStorage:
-    def __init__(self, file_path="transactions.json"):
+    def __init__(self, file_path="transactions.jsonl"):
         self.file_path = file_path
         self._ensure_file_exists()
 
+        # The file is an append-only log with one JSON transaction per line;
+        # it is replayed once here and every read is served from memory
+        self._transactions = self._read_transactions()
+        self._next_id = max((t["id"] for t in self._transactions), default=0) + 1
+        # Running totals per (year, month), so summaries never scan the log
+        self._by_month = {}
+        for transaction in self._transactions:
+            self._add_to_month(transaction)
+        self._lock = threading.Lock()
+        self._file = open(self.file_path, "ab")
+
     def _ensure_file_exists(self):
-        """Ensure the transactions file exists with proper structure"""
+        """Ensure the transactions log exists"""
         if not os.path.exists(self.file_path):
-            with open(self.file_path, "w") as f:
-                json.dump({"transactions": []}, f)
+            open(self.file_path, "w").close()
 
     def _read_transactions(self):
-        """Read all transactions from the file"""
-        with open(self.file_path, "r") as f:
-            return json.load(f)["transactions"]
+        """Read all transactions from the log"""
+        with open(self.file_path, "rb") as f:
+            return [orjson.loads(line) for line in f if line.strip()]
+
+    def _append_transaction(self, transaction):
+        """Append one transaction to the log (caller holds the lock)"""
+        # orjson emits compact bytes, ready to write as one log line
+        self._file.write(orjson.dumps(transaction) + b"\n")
+        self._file.flush()
+
+    def _add_to_month(self, transaction):
+        """Add a transaction to its month's running totals"""
+        date = transaction["date"]
+        key = (int(date[0:4]), int(date[5:7]))
+        bucket = self._by_month.get(key)
+        if bucket is None:
+            bucket = self._by_month[key] = {
+                "income": 0.0,
+                "expenses": 0.0,
+                "transactions": 0,
+            }
+        if transaction["type"] == _INCOME:
+            bucket["income"] += transaction["amount"]
+        else:
+            bucket["expenses"] += transaction["amount"]
+        bucket["transactions"] += 1
 
-    def _write_transactions(self, transactions):
-        """Write transactions to the file"""
-        with open(self.file_path, "w") as f:
-            json.dump({"transactions": transactions}, f, indent=2)
+    def close(self):
+        """Close the log file"""
+        with self._lock:
+            self._file.close()
 
     def add_transaction(self, type_, category, amount, date=None):
         """Add a new transaction"""
         if date is None:
-            date = datetime.utcnow()
+            # Naive UTC, matching what utcnow() (deprecated in 3.12) stored
+            date = datetime.now(timezone.utc).replace(tzinfo=None)
         elif isinstance(date, str):
-            date = datetime.strptime(date, "%Y-%m-%d")
-
-        transactions = self._read_transactions()
-
-        # Generate new ID (max existing ID + 1)
-        new_id = 1
-        if transactions:
-            new_id = max(t["id"] for t in transactions) + 1
-
-        transaction = {
-            "id": new_id,
-            "type": type_.value,
-            "category": category,
-            "amount": float(amount),
-            "date": date.isoformat(),
-        }
-
-        transactions.append(transaction)
-        self._write_transactions(transactions)
+            date = datetime.combine(parse_ymd(date), datetime.min.time())
+
+        with self._lock:
+            # Generate new ID (max existing ID + 1)
+            new_id = self._next_id
+            self._next_id += 1
+
+            transaction = {
+                "id": new_id,
+                "type": type_.value,
+                "category": category,
+                "amount": float(amount),
+                "date": date.isoformat(),
+            }
+
+            self._append_transaction(transaction)
+            self._transactions.append(transaction)
+            self._add_to_month(transaction)
         return new_id
 
     def get_transactions(self, start_date=None, end_date=None):
-        """Get all transactions within a date range"""
-        transactions = self._read_transactions()
+        """Get all transactions within a half-open date range [start_date, end_date)"""
+        transactions = list(self._transactions)
 
         if start_date:
             start_date = start_date.isoformat()
@@ -66,32 +105,18 @@ class FileStorage:
 
         if end_date:
             end_date = end_date.isoformat()
-            transactions = [t for t in transactions if t["date"] <= end_date]
+            transactions = [t for t in transactions if t["date"] < end_date]
 
         return transactions
 
     def get_monthly_summary(self, year, month):
         """Get summary of transactions for a specific month"""
-        start_date = datetime(year, month, 1)
-        if month == 12:
-            end_date = datetime(year + 1, 1, 1)
-        else:
-            end_date = datetime(year, month + 1, 1)
-
-        transactions = self.get_transactions(start_date, end_date)
-
-        summary = {
-            "income": sum(
-                float(t["amount"])
-                for t in transactions
-                if t["type"] == TransactionType.INCOME.value
-            ),
-            "expenses": sum(
-                float(t["amount"])
-                for t in transactions
-                if t["type"] == TransactionType.EXPENSE.value
-            ),
-            "transactions": len(transactions),
-        }
+        with self._lock:
+            bucket = self._by_month.get((year, month))
+            summary = (
+                dict(bucket)
+                if bucket
+                else {"income": 0.0, "expenses": 0.0, "transactions": 0}
+            )
         summary["balance"] = summary["income"] - summary["expenses"]
         return summary